@@ -4,20 +4,38 @@ Flask Application for Smart Stock Prediction System
 
 from flask import Flask
 from flask_cors import CORS
-from database import init_db
-from routes import products_bp, sales_bp, receipts_bp, barcode_bp
+from database import init_db, init_app, store_ids
+from metrics import init_metrics
+from pagination import NEXT_CURSOR_HEADER
+from events import init_events, prune_events, CATALOG_VERSION_HEADER
+from sale_queue import recover_journals
+from archive import archive_history_command
+from routes import products_bp, sales_bp, receipts_bp, barcode_bp, checkout_bp, health_bp, metrics_bp, stores_bp, events_bp
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=[NEXT_CURSOR_HEADER, CATALOG_VERSION_HEADER, 'ETag'])
+init_metrics(app)
+init_app(app)
+init_events(app)
+app.cli.add_command(archive_history_command)
 
 # Register blueprints
 app.register_blueprint(products_bp, url_prefix='/api')
 app.register_blueprint(sales_bp, url_prefix='/api')
 app.register_blueprint(receipts_bp, url_prefix='/api')
 app.register_blueprint(barcode_bp, url_prefix='/api')
+app.register_blueprint(checkout_bp, url_prefix='/api')
+app.register_blueprint(health_bp, url_prefix='/api')
+app.register_blueprint(metrics_bp, url_prefix='/api')
+app.register_blueprint(stores_bp, url_prefix='/api')
+app.register_blueprint(events_bp, url_prefix='/api')
 
-# Initialize database
-init_db()
+# Initialize each store's database, apply sales a crash left in write-behind
+# journals and trim the catalog change log (init_events keeps trimming it)
+for store in store_ids():
+    init_db(store)
+    recover_journals(store)
+    prune_events(store)
 
 @app.route('/')
 def home():
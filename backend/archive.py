@@ -0,0 +1,349 @@
+"""
+Hot/cold archival of old sales and receipts
+
+``flask archive-history`` moves sales, receipts and receipt items dated
+before a horizon (ARCHIVE_AFTER_DAYS ago by default) out of a store's live
+database into one SQLite database per year, next to it. Row ids are kept,
+so the (timestamp, id) pagination cursors stay valid across both.
+
+The cutoff is always midnight, so a day's rows are never split between
+live and archive, and the sales_daily rollup (which summaries and
+forecasts read) is left untouched.
+
+Rows are copied into the archive first and only then deleted from the live
+tables, in the same live transaction that advances the partition's
+``through`` date in archive_partitions. Archived rows are only read below
+that date, so a run interrupted between the two steps never shows a row
+twice, and the next run picks up where it stopped.
+
+Listings attach the archives of the years their date range reaches (all
+of them without a ``start``) and read the live table UNION ALL the
+archived rows. SQLite merges the timestamp-ordered branches, so a
+newest-first page still reads only about a page of rows. Exports read the
+same partitions one at a time, oldest first, then the live tables, so
+they cover any number of archived years. Single receipt lookups fall back
+to the archive holding the receipt when it isn't live.
+"""
+
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import click
+
+from database import DEFAULT_STORE, current_store, db_path, get_pool, store_ids
+from pagination import decode_cursor, encode_cursor, parse_bound
+
+# Sales and receipts older than this many days are archived by default
+ARCHIVE_AFTER_DAYS = int(os.environ.get('BILLING_ARCHIVE_AFTER_DAYS', 365))
+# Most archive databases one query attaches (SQLite allows 10 by default)
+MAX_ATTACHED = 8
+
+ARCHIVED_COLUMNS = {
+    'sales': "id, barcode, name, price, timestamp",
+    'receipts': "id, receipt_id, items, total_amount, payment_method, payment_status, customer_name, "
+                "customer_phone, amount_paid, change_amount, timestamp",
+    'receipt_items': "id, receipt_id, barcode, name, quantity, unit_price, subtotal",
+}
+
+# Archives only need the timestamp and receipt lookups the listings make
+ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS {schema}.sales (
+        id INTEGER PRIMARY KEY,
+        barcode TEXT NOT NULL,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        timestamp DATETIME
+    )''',
+    '''CREATE TABLE IF NOT EXISTS {schema}.receipts (
+        id INTEGER PRIMARY KEY,
+        receipt_id TEXT NOT NULL UNIQUE,
+        items TEXT NOT NULL,
+        total_amount REAL NOT NULL,
+        payment_method TEXT NOT NULL,
+        payment_status TEXT NOT NULL,
+        customer_name TEXT,
+        customer_phone TEXT,
+        amount_paid REAL NOT NULL,
+        change_amount REAL,
+        timestamp DATETIME
+    )''',
+    '''CREATE TABLE IF NOT EXISTS {schema}.receipt_items (
+        id INTEGER PRIMARY KEY,
+        receipt_id TEXT NOT NULL,
+        barcode TEXT,
+        name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price REAL NOT NULL,
+        subtotal REAL NOT NULL
+    )''',
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_sales_timestamp ON sales (timestamp)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_receipts_timestamp ON receipts (timestamp)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_receipt_items_receipt_id ON receipt_items (receipt_id)",
+]
+
+def archive_dir(store=DEFAULT_STORE):
+    """Directory holding a store's archive databases, next to its database file"""
+    base = os.environ.get('BILLING_ARCHIVE_DIR')
+    if base:
+        return base if store == DEFAULT_STORE else os.path.join(base, store)
+    path = db_path(store)
+    return str(path.parent / ('archive' if store == DEFAULT_STORE else f'{store}-archive'))
+
+def partition_path(store, year):
+    """Archive database of one year of a store's history"""
+    return os.path.join(archive_dir(store), f'{year}.db')
+
+def _schema(year):
+    return f'archive_{int(year)}'
+
+@contextmanager
+def attached(conn, partitions, store=None):
+    """Attach the archive databases of the given (year, through) partitions to conn
+
+    Each is attached as ``archive_<year>`` and detached again on exit. conn
+    must not be inside a transaction.
+    """
+    store = store or current_store()
+    schemas = []
+    try:
+        for year, _ in partitions:
+            conn.execute(f"ATTACH DATABASE ? AS {_schema(year)}", (partition_path(store, year),))
+            schemas.append(_schema(year))
+        yield conn
+    finally:
+        for schema in schemas:
+            conn.execute(f"DETACH DATABASE {schema}")
+
+def _partitions(conn, args, before=None, limit=-1):
+    """(year, through) partitions holding rows in the ``start``/``end`` range, newest first"""
+    start = parse_bound(args['start'], 'start')[0] if args.get('start') else ''
+    end_year = int(parse_bound(args['end'], 'end')[0][:4]) if args.get('end') else None
+    # A year's rows are all dated on or after its first day
+    rows = conn.execute('''
+        SELECT year, through FROM archive_partitions
+        WHERE through > ? AND (? IS NULL OR year <= ?) AND (? IS NULL OR printf('%d-01-01', year) < ?)
+        ORDER BY year DESC
+        LIMIT ?
+    ''', (start, end_year, end_year, before, before, limit)).fetchall()
+    return [(row['year'], row['through']) for row in rows]
+
+def partitions_for(conn, args):
+    """Every (year, through) archive partition a ``start``/``end`` query reaches, oldest first
+
+    Without ``start`` that is every partition up to ``end``. Raises
+    ValueError for bad dates.
+    """
+    return _partitions(conn, args)[::-1]
+
+def listing_partitions(conn, args):
+    """Archive partitions for one newest-first page, and a cursor past them
+
+    A page reads the MAX_ATTACHED newest partitions, at or before its
+    ``cursor``, that the ``start``/``end`` range reaches. If older ones were
+    left out, the second value is a cursor continuing the listing with
+    them, for when the page runs out of rows before reaching MAX_ATTACHED;
+    otherwise it is None.
+    """
+    before = decode_cursor(args['cursor'])[0] if args.get('cursor') else None
+    partitions = _partitions(conn, args, before, MAX_ATTACHED + 1)
+    if len(partitions) <= MAX_ATTACHED:
+        return partitions, None
+    partitions = partitions[:MAX_ATTACHED]
+    # Sorts before every timestamp of the oldest attached year, and after the older ones
+    return partitions, encode_cursor(f"{partitions[-1][0]}-01-01", 0)
+
+def find_receipt_partition(conn, receipt_id):
+    """The (year, through) partition an archived receipt is in, or None
+
+    Partitions are attached one at a time, so any number can be searched.
+    """
+    for partition in _partitions(conn, {}):
+        with attached(conn, [partition]):
+            found = conn.execute(
+                f"SELECT 1 FROM {_schema(partition[0])}.receipts WHERE receipt_id = ? AND timestamp < ?",
+                (receipt_id, partition[1])
+            ).fetchone()
+        if found:
+            return partition
+    return None
+
+def delete_archived_receipt(conn, receipt_id):
+    """Delete an archived receipt and its items; False if it isn't archived"""
+    partition = find_receipt_partition(conn, receipt_id)
+    if not partition:
+        return False
+    schema = _schema(partition[0])
+    with attached(conn, [partition]):
+        conn.execute(f"DELETE FROM {schema}.receipt_items WHERE receipt_id = ?", (receipt_id,))
+        conn.execute(f"DELETE FROM {schema}.receipts WHERE receipt_id = ?", (receipt_id,))
+        conn.commit()
+    return True
+
+def partition_table(table, partition, alias=None):
+    """FROM clause source for one partition of a history table
+
+    The live table when partition is None, else the rows of an attached
+    archive partition below its ``through`` date. A partition's receipt
+    items are not filtered that way, so join them to its receipts.
+    """
+    alias = alias or table
+    if partition is None:
+        return f"main.{table} AS {alias}"
+    year, through = partition
+    schema = _schema(year)
+    if table == 'receipt_items':
+        return f"{schema}.{table} AS {alias}"
+    # through is a date written by archive_history, never user input
+    visible = date.fromisoformat(through).isoformat()
+    return f"(SELECT {ARCHIVED_COLUMNS[table]} FROM {schema}.{table} WHERE timestamp < '{visible}') AS {alias}"
+
+def history_table(table, partitions, alias=None):
+    """FROM clause source for a history table
+
+    The live table itself, or with archive partitions (attached by
+    ``attached``) a UNION ALL of the live and archived rows under the
+    table's name, or alias if given.
+    """
+    alias = alias or table
+    if not partitions:
+        return table if alias == table else f"{table} {alias}"
+
+    columns = ARCHIVED_COLUMNS[table]
+    selects = [f"SELECT {columns} FROM main.{table}"]
+    for year, through in partitions:
+        schema = _schema(year)
+        # through is a date written by archive_history, never user input
+        visible = date.fromisoformat(through).isoformat()
+        if table == 'receipt_items':
+            where = f"receipt_id IN (SELECT receipt_id FROM {schema}.receipts WHERE timestamp < '{visible}')"
+        else:
+            where = f"timestamp < '{visible}'"
+        selects.append(f"SELECT {columns} FROM {schema}.{table} WHERE {where}")
+    return f"({' UNION ALL '.join(selects)}) AS {alias}"
+
+def _months(year, cutoff):
+    """(start, end) dates of each month of year before cutoff, the last one clipped"""
+    for month in range(1, 13):
+        start = date(year, month, 1)
+        if start >= cutoff:
+            break
+        end = date(year + month // 12, month % 12 + 1, 1)
+        yield start.isoformat(), min(end, cutoff).isoformat()
+
+def _discard_unpublished(conn, schema, year):
+    """Drop archived rows an interrupted run copied but never removed from the live tables"""
+    row = conn.execute("SELECT through FROM archive_partitions WHERE year = ?", (year,)).fetchone()
+    through = row['through'] if row else ''
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f'''
+            DELETE FROM {schema}.receipt_items WHERE receipt_id IN (
+                SELECT receipt_id FROM {schema}.receipts WHERE timestamp >= ?
+            )
+        ''', (through,))
+        conn.execute(f"DELETE FROM {schema}.receipts WHERE timestamp >= ?", (through,))
+        conn.execute(f"DELETE FROM {schema}.sales WHERE timestamp >= ?", (through,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def _move(conn, schema, year, start, end):
+    """Move the history dated in [start, end) into an attached archive
+
+    Returns the numbers of sales and receipts moved.
+    """
+    in_range = "timestamp >= ? AND timestamp < ?"
+    receipt_ids = f"SELECT receipt_id FROM main.receipts WHERE {in_range}"
+    bounds = (start, end)
+
+    # Copy into the archive and commit it before anything is deleted...
+    conn.execute("BEGIN")
+    try:
+        for table in ('sales', 'receipts'):
+            columns = ARCHIVED_COLUMNS[table]
+            conn.execute(f"INSERT OR IGNORE INTO {schema}.{table} ({columns}) "
+                         f"SELECT {columns} FROM main.{table} WHERE {in_range}", bounds)
+        columns = ARCHIVED_COLUMNS['receipt_items']
+        conn.execute(f"INSERT OR IGNORE INTO {schema}.receipt_items ({columns}) "
+                     f"SELECT {columns} FROM main.receipt_items WHERE receipt_id IN ({receipt_ids})", bounds)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    # ...then delete from the live tables and publish the archived rows together
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"DELETE FROM main.receipt_items WHERE receipt_id IN ({receipt_ids})", bounds)
+        receipts = conn.execute(f"DELETE FROM main.receipts WHERE {in_range}", bounds).rowcount
+        sales = conn.execute(f"DELETE FROM main.sales WHERE {in_range}", bounds).rowcount
+        # through never moves back, e.g. on a later run with a longer horizon
+        conn.execute('''
+            INSERT INTO archive_partitions (year, through, sales, receipts) VALUES (?, ?, ?, ?)
+            ON CONFLICT (year) DO UPDATE SET
+                through = MAX(through, excluded.through),
+                sales = sales + excluded.sales,
+                receipts = receipts + excluded.receipts,
+                archived_at = CURRENT_TIMESTAMP
+        ''', (year, end, sales, receipts))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return sales, receipts
+
+def archive_history(store=DEFAULT_STORE, before=None):
+    """Move a store's sales and receipts dated before ``before`` into yearly archives
+
+    ``before`` is a date, by default ARCHIVE_AFTER_DAYS ago (UTC, like the
+    stored timestamps). Rows are moved a month at a time, so the live
+    database is only write-locked briefly. Returns {year: (sales, receipts)}
+    moved.
+    """
+    cutoff = before or datetime.utcnow().date() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    store_pool = get_pool(store)
+    conn = store_pool.acquire()
+    moved = {}
+    try:
+        years = conn.execute('''
+            SELECT strftime('%Y', timestamp) FROM sales WHERE timestamp < ?
+            UNION
+            SELECT strftime('%Y', timestamp) FROM receipts WHERE timestamp < ?
+        ''', (cutoff.isoformat(), cutoff.isoformat())).fetchall()
+
+        for year in sorted(int(row[0]) for row in years):
+            os.makedirs(archive_dir(store), exist_ok=True)
+            schema = _schema(year)
+            with attached(conn, [(year, None)], store):
+                conn.execute(f"PRAGMA {schema}.journal_mode = WAL")
+                for statement in ARCHIVE_SCHEMA:
+                    conn.execute(statement.format(schema=schema))
+                _discard_unpublished(conn, schema, year)
+
+                sales = receipts = 0
+                for start, end in _months(year, cutoff):
+                    moved_sales, moved_receipts = _move(conn, schema, year, start, end)
+                    sales += moved_sales
+                    receipts += moved_receipts
+                # Compact the archive now that this year's rows are in
+                if sales or receipts:
+                    conn.execute(f"VACUUM {schema}")
+            moved[year] = (sales, receipts)
+    finally:
+        store_pool.release(conn)
+    return moved
+
+@click.command('archive-history')
+@click.option('--days', type=int, default=ARCHIVE_AFTER_DAYS, show_default=True,
+              help='Archive sales and receipts older than this many days.')
+def archive_history_command(days):
+    """Move old sales and receipts of every store into yearly archive databases"""
+    before = datetime.utcnow().date() - timedelta(days=days)
+    for store in store_ids():
+        moved = archive_history(store, before)
+        for year, (sales, receipts) in sorted(moved.items()):
+            click.echo(f"{store}: {year}: {sales} sales, {receipts} receipts archived")
+        if not moved:
+            click.echo(f"{store}: nothing before {before} to archive")
@@ -0,0 +1,14 @@
+"""
+HTTP benchmark suite for the billing API
+
+Run from the backend directory:
+
+    python -m benchmarks --mode client --concurrency 8 --requests 500
+    python -m benchmarks --mode server --output results/new.json --compare results/old.json
+    python -m benchmarks --mode url --url http://store-server:5000
+
+``client`` drives the app through Flask's test client (no network),
+``server`` starts the app on a local threaded HTTP server, and ``url``
+targets an already running deployment (e.g. one started with serve.py).
+The first two seed a throwaway database, so they never touch database.db.
+"""
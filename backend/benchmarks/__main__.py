@@ -0,0 +1,151 @@
+"""
+Command line entry point: python -m benchmarks --help
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .runner import compare, run_workload
+from .transport import HttpTransport, TestClientTransport
+from .workloads import build_workloads, seed_database
+
+DEFAULT_WORKLOADS = 'lookup,validate,checkout_1,checkout_5,checkout_20,checkout_40,receipts,sales_page,forecast,scan'
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmark the billing API")
+    parser.add_argument('--mode', choices=('client', 'server', 'url'), default='client')
+    parser.add_argument('--url', help="base URL of a running server (--mode url)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help="requests per workload")
+    parser.add_argument('--warmup', type=int, default=20, help="unmeasured requests per workload")
+    parser.add_argument('--workloads', default=DEFAULT_WORKLOADS, help="comma separated workload names")
+    parser.add_argument('--products', type=int, default=2000, help="catalog size to seed")
+    parser.add_argument('--history-days', type=int, default=90, help="days of sales history to seed")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for data and request mix")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    args = parser.parse_args()
+    if args.mode == 'url' and not args.url:
+        parser.error("--mode url needs --url")
+    return args
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_seeded_app(args, workdir):
+    """Import the app against a fresh database in workdir and seed it"""
+    import database
+    database.DB_PATH = Path(workdir) / 'benchmark.db'
+    from app import app
+
+    conn = database.get_db_connection()
+    try:
+        barcodes = seed_database(conn, products=args.products, history_days=args.history_days, seed=args.seed)
+    finally:
+        conn.close()
+    return app, barcodes
+
+def start_local_server(app):
+    """Serve app from a threaded werkzeug server on a free port"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass  # per-request logging would dominate the measurement
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def remote_barcodes(base_url):
+    """Barcodes of an already running deployment's catalog"""
+    with urllib.request.urlopen(f"{base_url.rstrip('/')}/api/products", timeout=30) as response:
+        return [product['barcode'] for product in json.load(response)]
+
+def print_table(results, changes):
+    header = f"{'workload':<14}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        print(f"{name:<14}{result['rps']:>9}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+              f"{result['p99_ms']:>10}{result['errors']:>8}")
+        if name in changes:
+            print(' ' * 14 + '  '.join(f"{key} {change:+.1f}%" for key, change in changes[name].items()))
+
+def main():
+    args = parse_args()
+    server = None
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.mode == 'url':
+            transport = HttpTransport(args.url)
+            barcodes = remote_barcodes(args.url)
+        else:
+            app, barcodes = load_seeded_app(args, workdir)
+            if args.mode == 'server':
+                server, base_url = start_local_server(app)
+                transport = HttpTransport(base_url)
+            else:
+                transport = TestClientTransport(app)
+
+        if not barcodes:
+            sys.exit("No products to benchmark against")
+
+        available = build_workloads(barcodes)
+        results = {}
+        try:
+            for name in args.workloads.split(','):
+                name = name.strip()
+                if name not in available:
+                    print(f"Skipping unknown or unavailable workload: {name}", file=sys.stderr)
+                    continue
+                results[name] = run_workload(available[name], transport, args.requests, args.concurrency,
+                                             warmup=args.warmup, seed=args.seed)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "mode": args.mode,
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "products": args.products,
+            "history_days": args.history_days,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    changes = {}
+    if args.compare:
+        with open(args.compare) as f:
+            changes = compare(report, json.load(f))
+        report["compared_to"] = {"file": args.compare, "changes_pct": changes}
+
+    print_table(results, changes)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Synthetic EAN-13 barcode images for the scan workloads
+"""
+
+# Left-hand digit encodings; R codes are the bitwise complement of L, G codes are R reversed
+L_CODES = ['0001101', '0011001', '0010011', '0111101', '0100011',
+           '0110001', '0101111', '0111011', '0110111', '0001011']
+# Parity of the six left-hand digits, selected by the first digit
+PARITY = ['LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG',
+          'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL']
+
+def check_digit(digits12):
+    """EAN-13 check digit for a 12-digit string"""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits12))
+    return str((10 - total % 10) % 10)
+
+def ean13(prefix, number):
+    """Build a valid 13-digit EAN from a numeric prefix and a sequence number"""
+    digits12 = f"{prefix}{number:0{12 - len(prefix)}d}"
+    return digits12 + check_digit(digits12)
+
+def _modules(code):
+    r_codes = [''.join('1' if bit == '0' else '0' for bit in l) for l in L_CODES]
+    g_codes = [r[::-1] for r in r_codes]
+    bits = '101'
+    for digit, parity in zip(code[1:7], PARITY[int(code[0])]):
+        bits += (L_CODES if parity == 'L' else g_codes)[int(digit)]
+    bits += '01010'
+    for digit in code[7:]:
+        bits += r_codes[int(digit)]
+    return bits + '101'
+
+def render_ean13(code, module_px=3, height=160, frame=(480, 640), encoding='.jpg'):
+    """Render a barcode centred on a camera-sized grey frame, encoded as JPEG or PNG bytes"""
+    import cv2
+    import numpy as np
+
+    bits = np.array([bit == '1' for bit in _modules(code)])
+    strip = np.where(np.repeat(bits, module_px), 0, 255).astype(np.uint8)
+    frame_height, frame_width = frame
+    image = np.full(frame, 200, dtype=np.uint8)
+    # White label with a quiet zone around the bars
+    top, left = (frame_height - height) // 2, (frame_width - strip.size) // 2
+    image[top - 20:top + height + 20, left - 11 * module_px:left + strip.size + 11 * module_px] = 255
+    image[top:top + height, left:left + strip.size] = strip
+    ok, encoded = cv2.imencode(encoding, image)
+    if not ok:
+        raise ValueError(f"Could not encode {encoding}")
+    return encoded.tobytes()
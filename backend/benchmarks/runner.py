@@ -0,0 +1,88 @@
+"""
+Concurrent request runner and latency statistics
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+def run_workload(workload, transport, requests, concurrency, warmup=20, seed=0):
+    """Send ``requests`` requests from ``concurrency`` threads and summarize latency
+
+    Statuses of 400 and above count as errors. Latencies are in milliseconds.
+    """
+    rng_lock = threading.Lock()
+    seeds = random.Random(seed)
+
+    def thread_rng():
+        with rng_lock:
+            return random.Random(seeds.random())
+
+    warm_rng = thread_rng()
+    for _ in range(warmup):
+        workload(transport, warm_rng)
+
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def worker():
+        rng = thread_rng()
+        latencies, statuses = [], {}
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    break
+            started = time.perf_counter()
+            try:
+                status = workload(transport, rng)
+            except Exception:
+                status = 'exception'
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+        return latencies, statuses
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [future.result() for future in [executor.submit(worker) for _ in range(concurrency)]]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for thread_latencies, _ in results for latency in thread_latencies)
+    statuses = {}
+    for _, thread_statuses in results:
+        for status, count in thread_statuses.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+    errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400)
+
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "errors": errors,
+        "statuses": statuses,
+    }
+
+def compare(current, baseline):
+    """Relative change of each workload's headline numbers against a baseline run"""
+    changes = {}
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            key: round((result[key] - before[key]) / before[key] * 100, 1)
+            for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms') if before.get(key)
+        }
+    return changes
@@ -0,0 +1,62 @@
+"""
+Ways of sending benchmark requests: in-process test client or real HTTP
+"""
+
+import http.client
+import json
+import threading
+from urllib.parse import urlsplit
+
+class TestClientTransport:
+    """Flask test client, one per thread"""
+
+    name = 'client'
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, data=body, headers=headers or {})
+        response.close()
+        return response.status_code
+
+class HttpTransport:
+    """Keep-alive HTTP connections to a running server, one per thread"""
+
+    name = 'http'
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                # The server may close idle keep-alive connections; reconnect once
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+def json_body(data):
+    """Encode a JSON request body and its headers"""
+    return json.dumps(data).encode('utf-8'), {'Content-Type': 'application/json'}
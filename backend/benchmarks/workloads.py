@@ -0,0 +1,84 @@
+"""
+Benchmark data seeding and request workloads
+
+Each workload is a callable taking (transport, rng) that sends one request
+and returns the HTTP status code.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from .images import ean13, render_ean13
+from .transport import json_body
+
+BARCODE_PREFIX = '890'
+BASKET_SIZES = (1, 5, 20, 40)
+
+def seed_database(conn, products=2000, history_days=90, sales_per_day=300, seed=1):
+    """Fill an empty database with a catalog and sales history
+
+    Returns the list of seeded barcodes.
+    """
+    rng = random.Random(seed)
+    barcodes = [ean13(BARCODE_PREFIX, i) for i in range(products)]
+    conn.executemany(
+        "INSERT OR REPLACE INTO products (barcode, name, price, stock) VALUES (?, ?, ?, ?)",
+        # Deep stock so checkout workloads never run out mid-benchmark
+        [(barcode, f"Product {i}", round(rng.uniform(5, 500), 2), 10_000_000)
+         for i, barcode in enumerate(barcodes)]
+    )
+
+    # Skewed popularity, like a real store: a few items sell most units
+    weights = [1 / (rank + 1) for rank in range(products)]
+    now = datetime.utcnow()
+    sales = []
+    for day in range(history_days):
+        day_start = now - timedelta(days=day)
+        for barcode in rng.choices(barcodes, weights=weights, k=sales_per_day):
+            timestamp = (day_start - timedelta(seconds=rng.randrange(86400))).strftime('%Y-%m-%d %H:%M:%S')
+            sales.append((barcode, 'seed', 10.0, timestamp))
+    conn.executemany("INSERT INTO sales (barcode, name, price, timestamp) VALUES (?, ?, ?, ?)", sales)
+    conn.commit()
+    return barcodes
+
+def _checkout(basket_size, barcodes):
+    def run(transport, rng):
+        items = [{"barcode": barcode, "quantity": rng.randint(1, 3)}
+                 for barcode in rng.sample(barcodes, basket_size)]
+        body, headers = json_body({
+            "items": items,
+            "payment_method": "CASH",
+            "payment_status": "COMPLETED",
+            "customer_name": "Benchmark",
+            "customer_phone": ""
+        })
+        return transport.request('POST', '/api/checkout', body, headers)
+    return run
+
+def _scan(frames):
+    def run(transport, rng):
+        return transport.request('POST', '/api/barcode/scan', rng.choice(frames),
+                                 {'Content-Type': 'image/jpeg', 'X-Scan-Session': f"bench-{rng.random()}"})
+    return run
+
+def build_workloads(barcodes):
+    """All workloads keyed by name"""
+    hot = barcodes[:200]  # most lookups hit popular items, as at a real till
+
+    workloads = {
+        'lookup': lambda t, rng: t.request('GET', f"/api/products/{rng.choice(hot)}"),
+        'validate': lambda t, rng: t.request('GET', f"/api/barcode/validate/{rng.choice(barcodes)}"),
+        'receipts': lambda t, rng: t.request('GET', '/api/receipts?limit=50'),
+        'sales_page': lambda t, rng: t.request('GET', '/api/sales?limit=100'),
+        'forecast': lambda t, rng: t.request('GET', '/api/forecast'),
+    }
+    for size in BASKET_SIZES:
+        workloads[f'checkout_{size}'] = _checkout(size, barcodes)
+
+    try:
+        frames = [render_ean13(barcode) for barcode in hot[:10]]
+    except ImportError:
+        pass  # imaging stack not installed; scan workloads unavailable
+    else:
+        workloads['scan'] = _scan(frames)
+    return workloads
@@ -0,0 +1,119 @@
+"""
+In-process barcode -> product cache for the scan/lookup hot path
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from database import current_store, get_db_connection
+
+# Bounds for the cache. Each worker process keeps its own cache and only sees
+# its own invalidations, so CACHE_TTL caps how stale another worker's writes
+# (e.g. stock after a sale) can appear.
+CACHE_MAX_SIZE = 10000
+CACHE_TTL = 60  # seconds
+
+class ProductCache:
+    """Bounded LRU cache with TTL, keyed by store and barcode
+
+    Methods act on the current request's store unless one is given.
+    Unknown barcodes are cached too (as None) so repeated scans of an
+    unregistered item don't hit the database either.
+    """
+
+    def __init__(self, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (store, barcode) -> (expires_at, product or None)
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a lookup that raced with a write
+        # doesn't store the value it read before the write committed
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, barcode, loader, store=None):
+        """Return the cached product for barcode, calling loader(barcode) on a miss"""
+        key = (store or current_store(), barcode)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        product = loader(barcode)
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (now + self.ttl, product)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return product
+
+    def warm(self, products, store=None):
+        """Preload product dicts, e.g. at startup, without counting misses"""
+        store = store or current_store()
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for product in products:
+                self._entries[(store, product['barcode'])] = (expires_at, product)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *barcodes, store=None):
+        """Drop the given barcodes; call after the write has committed"""
+        store = store or current_store()
+        with self._lock:
+            self._generation += 1
+            for barcode in barcodes:
+                self._entries.pop((store, barcode), None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+product_cache = ProductCache()
+
+def _load_product(barcode):
+    row = get_db_connection().execute("SELECT * FROM products WHERE barcode = ?", (barcode,)).fetchone()
+    return dict(row) if row else None
+
+def get_cached_product(barcode):
+    """Look up a product by barcode through the shared cache
+
+    Returns a dict of the product's columns, or None if it doesn't exist.
+    A database connection is only taken on a cache miss.
+    """
+    product = product_cache.get(barcode, _load_product)
+    return dict(product) if product else None
+
+
+def warm_product_cache(conn, store=None):
+    """Load up to the cache's capacity of a store's products into the cache
+
+    Returns the number of products loaded.
+    """
+    rows = conn.execute("SELECT * FROM products LIMIT ?", (product_cache.max_size,)).fetchall()
+    product_cache.warm((dict(row) for row in rows), store)
+    return len(rows)
\ No newline at end of file
@@ -2,22 +2,576 @@
 Database configuration and utilities
 """
 
+import json
+import logging
+import os
+import queue
+import random
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import click
+from flask import g, has_app_context, has_request_context, jsonify, request
+
 DB_PATH = Path(__file__).parent / 'database.db'
 
-def get_db_connection():
-    """Get a database connection"""
-    conn = sqlite3.connect(DB_PATH)
+# Maximum number of idle connections kept around for reuse
+POOL_SIZE = 8
+
+# Per-connection tuning, applied once when a pooled connection is opened.
+# WAL itself is persistent in the database file and is enabled in init_db().
+CONNECTION_PRAGMAS = {
+    'synchronous': 'NORMAL',    # safe with WAL, avoids an fsync per commit
+    'cache_size': -16000,       # ~16MB page cache (negative = KiB)
+    'mmap_size': 268435456,     # 256MB memory-mapped I/O
+    'busy_timeout': 5000,       # wait up to 5s for a write lock instead of failing
+    'temp_store': 'MEMORY',
+}
+
+# Statements slower than this are logged with their query plan. Only a
+# SLOW_QUERY_SAMPLE fraction of them are logged, so the log can stay on in
+# production; set BILLING_SLOW_QUERY_MS=0 to disable it entirely.
+SLOW_QUERY_MS = float(os.environ.get('BILLING_SLOW_QUERY_MS', 100))
+SLOW_QUERY_SAMPLE = float(os.environ.get('BILLING_SLOW_QUERY_SAMPLE', 1.0))
+# Statements whose plan is worth capturing (not PRAGMA, BEGIN, COMMIT, ...)
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+slow_query_log = logging.getLogger('billing.slow_query')
+
+def _record_query(elapsed):
+    """Charge a statement's execution time to the current request, if any"""
+    if has_app_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+
+def query_plan(conn, sql, parameters=()):
+    """EXPLAIN QUERY PLAN detail lines for sql, or [] if it can't be explained"""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    try:
+        # Called on the base class so explaining isn't itself timed or logged
+        rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    except sqlite3.Error:
+        return []
+    return [row[3] for row in rows]
+
+def _log_slow_query(conn, sql, parameters, elapsed):
+    """Log a slow statement with its plan and the route that issued it"""
+    if SLOW_QUERY_SAMPLE < 1 and random.random() >= SLOW_QUERY_SAMPLE:
+        return
+    route = f"{request.method} {request.path} ({request.endpoint})" if has_request_context() else "no request"
+    plan = query_plan(conn, sql, parameters) if parameters is not None else []
+    # "SCAN t" without "USING ... INDEX" reads the whole table
+    full_scan = any(line.startswith('SCAN ') and 'USING' not in line for line in plan)
+    slow_query_log.warning(
+        "slow query %.1fms%s from %s: %s%s",
+        elapsed * 1000,
+        " [full table scan]" if full_scan else "",
+        route,
+        ' '.join(sql.split()),
+        ''.join(f"\n    plan: {line}" for line in plan)
+    )
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that times execute/executemany for per-request SQL stats
+
+    Only the execute call is timed (for SQLite that includes stepping to the
+    first row); iterating or fetching the remaining rows is not. Statements
+    over SLOW_QUERY_MS are passed to the slow query log.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            result = super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            _record_query(elapsed)
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            _log_slow_query(self.connection, sql, parameters, elapsed)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            result = super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            _record_query(elapsed)
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            # The parameter sets may have been a generator, so the plan can't be re-bound
+            _log_slow_query(self.connection, sql, None, elapsed)
+        return result
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the conn.execute shortcuts, are TimedCursors"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# Multi-store deployments list their store ids in BILLING_STORES (e.g.
+# "north,south"). Each store then gets its own database file, pool and write
+# lock in STORES_DIR, and requests name their store with the X-Store-Id
+# header or ?store= parameter. Without BILLING_STORES there is a single
+# store whose database is DB_PATH, and the header is ignored.
+DEFAULT_STORE = 'default'
+STORE_HEADER = 'X-Store-Id'
+STORE_IDS = [store.strip() for store in os.environ.get('BILLING_STORES', '').split(',') if store.strip()]
+STORES_DIR = os.environ.get('BILLING_STORES_DIR')
+
+class UnknownStore(Exception):
+    """Raised when a request names no store, or one this server doesn't serve"""
+
+def store_ids():
+    """Ids of every store served by this instance"""
+    return STORE_IDS or [DEFAULT_STORE]
+
+def db_path(store=DEFAULT_STORE):
+    """Database file of a store"""
+    if store == DEFAULT_STORE:
+        return DB_PATH
+    return Path(STORES_DIR or DB_PATH.parent / 'stores') / f'{store}.db'
+
+def current_store():
+    """The store the current request is for
+
+    Outside a request this is the first configured store.
+    """
+    if not STORE_IDS:
+        return DEFAULT_STORE
+    if not has_request_context():
+        return STORE_IDS[0]
+    if 'store' in g:
+        return g.store
+    store = request.headers.get(STORE_HEADER) or request.args.get('store')
+    if not store:
+        raise UnknownStore(f"{STORE_HEADER} header is required")
+    if store not in STORE_IDS:
+        raise UnknownStore(f"Unknown store: {store}")
+    return store
+
+def _connect(store=DEFAULT_STORE):
+    """Open a new tuned connection"""
+    conn = sqlite3.connect(db_path(store), check_same_thread=False, factory=TimedConnection)
     conn.row_factory = sqlite3.Row  # This enables column access by name
+    for pragma, value in CONNECTION_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
     return conn
 
-def init_db():
-    """Initialize the SQLite database with required tables"""
-    conn = sqlite3.connect(DB_PATH)
+class ConnectionPool:
+    """Thread-safe pool of reusable SQLite connections to one store's database"""
+
+    def __init__(self, store=DEFAULT_STORE, size=POOL_SIZE):
+        self.store = store
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_fork(self):
+        # Connections must not be shared across processes (e.g. forked workers)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue(maxsize=self.size)
+                    self._pid = os.getpid()
+
+    def acquire(self):
+        """Take an idle connection, opening a new one if none are available"""
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _connect(self.store)
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work"""
+        self._check_fork()
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(store=None):
+    """The connection pool of a store, by default the current request's"""
+    if store is None:
+        store = current_store()
+    try:
+        return _pools[store]
+    except KeyError:
+        with _pools_lock:
+            return _pools.setdefault(store, ConnectionPool(store))
+
+def close_all_pools():
+    """Close the idle connections of every store, e.g. before forking workers"""
+    for store_pool in list(_pools.values()):
+        store_pool.close_all()
+
+def get_db_connection(store=None):
+    """Get a database connection to a store, by default the current request's
+
+    Inside a Flask request the same pooled connection is reused for the whole
+    request and returned to the pool on teardown, so callers must not close it.
+    Outside an app context a dedicated connection is returned and the caller
+    is responsible for closing it.
+    """
+    if not has_app_context():
+        return _connect(store or current_store())
+    if 'db' not in g:
+        g.db_pool = get_pool(store)
+        g.db = g.db_pool.acquire()
+    return g.db
+
+def close_db(exc=None):
+    """Return the request's connection to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        g.pop('db_pool').release(conn)
+
+def fan_out(func, stores=None):
+    """Run func(conn, store) against every store in parallel
+
+    Each store is queried on its own pooled connection and thread, so a
+    head-office report costs roughly as much as its slowest store. Returns
+    {store: result}.
+    """
+    stores = stores or store_ids()
+
+    def run(store):
+        store_pool = get_pool(store)
+        conn = store_pool.acquire()
+        try:
+            return func(conn, store)
+        finally:
+            store_pool.release(conn)
+
+    if len(stores) == 1:
+        return {stores[0]: run(stores[0])}
+    with ThreadPoolExecutor(max_workers=len(stores)) as executor:
+        return dict(zip(stores, executor.map(run, stores)))
+
+# Blueprints that serve every store at once (or none), so need no store id
+STORELESS_BLUEPRINTS = {'health', 'metrics', 'stores'}
+
+def _resolve_store():
+    """Reject requests for an unknown store before any view code runs"""
+    if STORE_IDS and request.blueprint not in STORELESS_BLUEPRINTS and request.endpoint is not None:
+        g.store = current_store()
+
+def _unknown_store(e):
+    return jsonify({"error": str(e)}), 400
+
+def init_app(app):
+    """Register store resolution, the connection teardown and database commands with a Flask app"""
+    app.before_request(_resolve_store)
+    app.teardown_appcontext(close_db)
+    app.register_error_handler(UnknownStore, _unknown_store)
+    app.cli.add_command(backfill_sales_daily_command)
+
+@click.command('backfill-sales-daily')
+def backfill_sales_daily_command():
+    """Rebuild the sales_daily rollup from the sales table of every store"""
+    for store in store_ids():
+        conn = _connect(store)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = backfill_sales_daily(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo(f"{store}: sales_daily rebuilt: {rows} rows")
+
+def receipt_item_rows(receipt_id, items):
+    """Convert receipt line dicts into receipt_items insert tuples"""
+    rows = []
+    for item in items:
+        quantity = int(item.get('quantity', 1))
+        unit_price = float(item['price'])
+        subtotal = float(item.get('subtotal', unit_price * quantity))
+        rows.append((receipt_id, item.get('barcode'), item['name'], quantity, unit_price, subtotal))
+    return rows
+
+def _create_receipt_items(conn):
+    """Add receipt_items and move the legacy JSON items blobs into it"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS receipt_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            receipt_id TEXT NOT NULL,
+            barcode TEXT,
+            name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_price REAL NOT NULL,
+            subtotal REAL NOT NULL,
+            FOREIGN KEY (receipt_id) REFERENCES receipts (receipt_id)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_receipt_items_receipt_id ON receipt_items (receipt_id)")
+
+    # Receipts already moved have their blob cleared to '[]', so this is safe to repeat
+    for receipt_id, items in conn.execute("SELECT receipt_id, items FROM receipts WHERE items != '[]'").fetchall():
+        try:
+            rows = receipt_item_rows(receipt_id, json.loads(items))
+        except (ValueError, TypeError, KeyError):
+            continue  # leave unparseable receipts untouched
+        conn.executemany(
+            "INSERT INTO receipt_items (receipt_id, barcode, name, quantity, unit_price, subtotal) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.execute("UPDATE receipts SET items = '[]' WHERE receipt_id = ?", (receipt_id,))
+
+def _create_history_indexes(conn):
+    """Index the timestamp-ordered history tables"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_barcode_timestamp ON sales (barcode, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_timestamp ON sales (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_receipts_timestamp ON receipts (timestamp)")
+
+def _create_sales_daily(conn):
+    """Add the sales_daily rollup, kept current by a trigger on sales"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            barcode TEXT NOT NULL,
+            day TEXT NOT NULL,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (barcode, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_daily_day ON sales_daily (day)")
+    # Every sales row is one unit sold, so each insert adds one unit and its price
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_sales_daily_insert AFTER INSERT ON sales
+        BEGIN
+            INSERT INTO sales_daily (barcode, day, units, revenue)
+            VALUES (NEW.barcode, date(NEW.timestamp), 1, NEW.price)
+            ON CONFLICT (barcode, day) DO UPDATE SET
+                units = units + 1,
+                revenue = revenue + excluded.revenue;
+        END
+    ''')
+    backfill_sales_daily(conn)
+
+def _create_sale_journal_state(conn):
+    """Track how much of each write-behind sales journal has been applied"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sale_journal_state (
+            journal TEXT PRIMARY KEY,
+            applied_seq INTEGER NOT NULL
+        )
+    ''')
+
+def _create_catalog_events(conn):
+    """Add the catalog_events change log, filled by triggers on products
+
+    Every product insert, update and delete - whichever route, worker or
+    batch writer made it - appends one row, so the log's sequence numbers
+    order all catalog changes of a store.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            barcode TEXT NOT NULL,
+            product TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    product_json = "json_object('barcode', NEW.barcode, 'name', NEW.name, 'price', NEW.price, 'stock', NEW.stock)"
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_events_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO catalog_events (type, barcode, product)
+            VALUES ('product.created', NEW.barcode, {product_json});
+        END
+    ''')
+    # Stock-only changes (sales, checkouts, adjustments) get their own type
+    # so clients can cheaply patch a level instead of a whole product
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_events_update AFTER UPDATE ON products
+        WHEN OLD.name IS NOT NEW.name OR OLD.price IS NOT NEW.price OR OLD.stock IS NOT NEW.stock
+             OR OLD.barcode IS NOT NEW.barcode
+        BEGIN
+            INSERT INTO catalog_events (type, barcode, product)
+            VALUES (
+                CASE WHEN OLD.name IS NEW.name AND OLD.price IS NEW.price AND OLD.barcode IS NEW.barcode
+                     THEN 'stock.changed' ELSE 'product.updated' END,
+                NEW.barcode, {product_json}
+            );
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_events_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO catalog_events (type, barcode, product)
+            VALUES ('product.deleted', OLD.barcode, NULL);
+        END
+    ''')
+
+def fts5_available(conn):
+    """Whether this SQLite build has the FTS5 full-text search module"""
+    return conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0] == 1
+
+def _create_product_search(conn):
+    """Add the products_fts name index, kept in sync by triggers on products
+
+    Skipped on SQLite builds without FTS5; product search then falls back
+    to LIKE scans.
+    """
+    if not fts5_available(conn):
+        return
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, barcode UNINDEXED,
+            content='products', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        )
+    ''')
+    # Distinct indexed terms, used to suggest corrections for misspelt words
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS products_fts_vocab USING fts5vocab(products_fts, 'row')")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, name, barcode) VALUES (NEW.rowid, NEW.name, NEW.barcode);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, barcode)
+            VALUES ('delete', OLD.rowid, OLD.name, OLD.barcode);
+        END
+    ''')
+    # Only name/barcode changes touch the index, not the stock updates of every sale
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_update AFTER UPDATE OF name, barcode ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, barcode)
+            VALUES ('delete', OLD.rowid, OLD.name, OLD.barcode);
+            INSERT INTO products_fts (rowid, name, barcode) VALUES (NEW.rowid, NEW.name, NEW.barcode);
+        END
+    ''')
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+def _create_archive_partitions(conn):
+    """Add archive_partitions, one row per yearly archive database of old history
+
+    Sales and receipts of a partition's year dated before its ``through``
+    date have been moved out of the live tables; see archive.py.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_partitions (
+            year INTEGER PRIMARY KEY,
+            through TEXT NOT NULL,
+            sales INTEGER NOT NULL DEFAULT 0,
+            receipts INTEGER NOT NULL DEFAULT 0,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _add_receipt_payment_columns(conn):
+    """Add the customer and payment columns to receipts tables created before them
+
+    Receipts recorded before then are taken to have been paid exactly.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(receipts)")}
+    for column, definition in (
+        ('customer_name', "TEXT DEFAULT 'Customer'"),
+        ('customer_phone', "TEXT DEFAULT ''"),
+        ('amount_paid', "REAL NOT NULL DEFAULT 0"),
+        ('change_amount', "REAL DEFAULT 0"),
+    ):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE receipts ADD COLUMN {column} {definition}")
+    if 'amount_paid' not in columns:
+        conn.execute("UPDATE receipts SET amount_paid = total_amount")
+
+# Schema migrations in order. Migration N (1-based) brings the database to
+# PRAGMA user_version N. Only append to this list; never reorder or edit
+# migrations that have shipped, and keep each one idempotent.
+MIGRATIONS = [
+    _create_receipt_items,
+    _create_history_indexes,
+    _create_sales_daily,
+    _create_sale_journal_state,
+    _create_catalog_events,
+    _create_product_search,
+    _create_archive_partitions,
+    _add_receipt_payment_columns,
+]
+
+def run_migrations(conn):
+    """Apply pending migrations, each in its own transaction, then refresh statistics
+
+    Returns the number of migrations applied.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    pending = MIGRATIONS[version:]
+
+    for number, migration in enumerate(pending, start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    # Give the query planner fresh statistics for the new indexes; otherwise
+    # let SQLite decide whether anything is worth re-analyzing.
+    if pending:
+        conn.execute("ANALYZE")
+    else:
+        conn.execute("PRAGMA optimize")
+    conn.commit()
+    return len(pending)
+
+def backfill_sales_daily(conn):
+    """Rebuild sales_daily from the sales table
+
+    Runs in the caller's transaction. Returns the number of rollup rows.
+    """
+    conn.execute('''
+        INSERT OR REPLACE INTO sales_daily (barcode, day, units, revenue)
+        SELECT barcode, date(timestamp), COUNT(*), SUM(price)
+        FROM sales
+        WHERE timestamp IS NOT NULL
+        GROUP BY barcode, date(timestamp)
+    ''')
+    return conn.execute("SELECT COUNT(*) FROM sales_daily").fetchone()[0]
+
+def init_db(store=DEFAULT_STORE):
+    """Initialize a store's SQLite database with required tables"""
+    path = db_path(store)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
     cursor = conn.cursor()
     
+    # Write-ahead logging lets readers proceed while a checkout is writing.
+    # The mode is stored in the database file, so it only needs setting once.
+    cursor.execute("PRAGMA journal_mode = WAL")
+    
     # Create products table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS products (
@@ -71,4 +625,6 @@ def init_db():
         cursor.executemany("INSERT INTO products VALUES (?, ?, ?, ?)", sample_products)
     
     conn.commit()
-    conn.close()
\ No newline at end of file
+    
+    run_migrations(conn)
+    conn.close()
@@ -0,0 +1,207 @@
+"""
+Server-sent event stream of catalog changes
+
+Changes are read from the catalog_events table, which triggers on products
+fill whichever process made the change, so a stream sees every worker's
+writes. Each event's id is its sequence number; a reconnecting client
+sends it back as Last-Event-ID (or ?after=) and resumes where it left off.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from database import DEFAULT_STORE, UnknownStore, current_store, get_pool
+
+# Seconds between checks for new events while a stream is idle
+EVENTS_POLL_INTERVAL = float(os.environ.get('BILLING_EVENTS_POLL_INTERVAL', 0.5))
+# Seconds a stream stays open before the client is asked to reconnect; this
+# bounds how long one stream ties up a server thread
+EVENTS_STREAM_TIMEOUT = float(os.environ.get('BILLING_EVENTS_STREAM_TIMEOUT', 300))
+# Concurrent streams allowed per process, so streams can't take every request thread
+EVENTS_MAX_STREAMS = int(os.environ.get('BILLING_EVENTS_MAX_STREAMS', 4))
+# Seconds between keep-alive comments that stop proxies closing quiet streams
+KEEPALIVE_INTERVAL = 15
+# Events kept per store; older ones are pruned at startup and then every
+# EVENTS_PRUNE_INTERVAL seconds while the process serves requests
+EVENTS_RETENTION = int(os.environ.get('BILLING_EVENTS_RETENTION', 100000))
+EVENTS_PRUNE_INTERVAL = float(os.environ.get('BILLING_EVENTS_PRUNE_INTERVAL', 600))
+# Most events sent in one read
+EVENTS_BATCH_SIZE = 500
+# Response header carrying the catalog version (the newest event's sequence number)
+CATALOG_VERSION_HEADER = 'X-Catalog-Version'
+
+class TooManyStreams(Exception):
+    """Raised when EVENTS_MAX_STREAMS streams are already open in this process"""
+
+_open_streams = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+# When this process last pruned each store's log (time.monotonic())
+_last_pruned = {}
+_prune_lock = threading.Lock()
+
+def read_events(conn, after, limit=EVENTS_BATCH_SIZE):
+    """Events with a sequence number above after, oldest first"""
+    rows = conn.execute(
+        "SELECT seq, type, barcode, product, created_at FROM catalog_events WHERE seq > ? ORDER BY seq LIMIT ?",
+        (after, limit)
+    ).fetchall()
+    return [
+        {
+            "seq": row['seq'],
+            "type": row['type'],
+            "barcode": row['barcode'],
+            "product": json.loads(row['product']) if row['product'] else None,
+            "created_at": row['created_at'],
+        }
+        for row in rows
+    ]
+
+def latest_seq(conn):
+    """Sequence number of the newest event, or 0 if there are none"""
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM catalog_events").fetchone()[0]
+
+def oldest_seq(conn):
+    """Sequence number of the oldest retained event, or None if there are none"""
+    return conn.execute("SELECT MIN(seq) FROM catalog_events").fetchone()[0]
+
+def prune_events(store=DEFAULT_STORE, keep=EVENTS_RETENTION):
+    """Delete all but a store's newest keep events; returns the number deleted"""
+    store_pool = get_pool(store)
+    conn = store_pool.acquire()
+    try:
+        cursor = conn.execute("DELETE FROM catalog_events WHERE seq <= ?", (latest_seq(conn) - keep,))
+        conn.commit()
+        with _prune_lock:
+            _last_pruned[store] = time.monotonic()
+        return cursor.rowcount
+    finally:
+        store_pool.release(conn)
+
+def _prune_when_due(response):
+    # Every sale and checkout line adds a stock event, so a long-running
+    # server has to keep trimming the log, not just at startup
+    try:
+        store = current_store()
+    except UnknownStore:
+        return response
+    now = time.monotonic()
+    with _prune_lock:
+        if now - _last_pruned.get(store, float('-inf')) < EVENTS_PRUNE_INTERVAL:
+            return response
+        # Claimed now so concurrent requests don't all prune
+        _last_pruned[store] = now
+    try:
+        prune_events(store)
+    except sqlite3.Error:
+        pass  # e.g. busy; tried again next interval
+    return response
+
+def init_events(app):
+    """Prune the request's store's change log every EVENTS_PRUNE_INTERVAL seconds"""
+    app.after_request(_prune_when_due)
+
+def catalog_changes(conn, since, version):
+    """Net changes between two catalog versions (event sequence numbers)
+
+    Returns (changed, deleted): the latest state of every product changed in
+    (since, version] and the barcodes of those deleted in that range.
+    Raises ValueError if since is no longer covered by the retained log.
+    """
+    oldest = oldest_seq(conn)
+    if since > version or (oldest is not None and since < oldest - 1):
+        raise ValueError("since is outside the change log; reload the full catalog")
+
+    rows = conn.execute('''
+        SELECT ce.barcode, ce.type, ce.product
+        FROM catalog_events ce
+        JOIN (
+            SELECT MAX(seq) AS seq FROM catalog_events
+            WHERE seq > ? AND seq <= ?
+            GROUP BY barcode
+        ) latest ON latest.seq = ce.seq
+        ORDER BY ce.seq
+    ''', (since, version)).fetchall()
+    changed = [json.loads(row['product']) for row in rows if row['type'] != 'product.deleted']
+    deleted = [row['barcode'] for row in rows if row['type'] == 'product.deleted']
+    return changed, deleted
+
+def format_event(event):
+    """Encode an event in the text/event-stream wire format"""
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+def open_stream(store_pool, after):
+    """Start a stream of events after the given sequence number
+
+    ``after=None`` starts from the newest event, so only future changes are
+    sent. If after is older than the retained log the client is sent a
+    ``catalog.reset`` event and should reload the full product list.
+    Raises TooManyStreams if this process is already serving its limit.
+    """
+    if not _open_streams.acquire(blocking=False):
+        raise TooManyStreams()
+    try:
+        conn = store_pool.acquire()
+        try:
+            newest = latest_seq(conn)
+            oldest = oldest_seq(conn)
+        finally:
+            store_pool.release(conn)
+    except Exception:
+        _open_streams.release()
+        raise
+
+    # A client that missed pruned events, or is resuming against a different
+    # database, can't be brought up to date from the log
+    reset = after is not None and ((oldest is not None and after < oldest - 1) or after > newest)
+    if after is None or reset:
+        after = newest
+    return EventStream(_stream(store_pool, after, reset))
+
+class EventStream:
+    """Response body that frees its stream slot when the server closes it
+
+    The WSGI server calls close() even if the client disconnects before the
+    first chunk, when a bare generator's finally block would never run.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._closed = False
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._chunks.close()
+            _open_streams.release()
+
+def _stream(store_pool, after, reset):
+    # Ask EventSource to wait a second before reconnecting
+    yield "retry: 1000\n\n"
+    if reset:
+        yield format_event({"seq": after, "type": "catalog.reset", "barcode": None, "product": None,
+                            "created_at": None})
+
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < EVENTS_STREAM_TIMEOUT:
+        conn = store_pool.acquire()
+        try:
+            events = read_events(conn, after)
+        finally:
+            store_pool.release(conn)
+
+        if events:
+            after = events[-1]['seq']
+            yield ''.join(format_event(event) for event in events)
+            last_sent = time.monotonic()
+            if len(events) == EVENTS_BATCH_SIZE:
+                continue  # more waiting; don't sleep
+        elif time.monotonic() - last_sent >= KEEPALIVE_INTERVAL:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        time.sleep(EVENTS_POLL_INTERVAL)
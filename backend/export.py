@@ -0,0 +1,117 @@
+"""
+Streaming NDJSON/CSV export helpers
+
+Rows are pulled from SQLite with fetchmany and encoded as they go, so an
+export uses the same memory whether the table holds a day or years of history.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from flask import Response
+
+from archive import attached
+from database import get_pool
+
+EXPORT_BATCH_SIZE = 1000
+# Encoded output is flushed to the client in chunks of roughly this many bytes
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def iter_segments(segments):
+    """Yield the rows of each (query, params, partitions) in turn from a dedicated pooled connection
+
+    The connection is held for the life of the stream rather than the
+    request, since the response body is produced after the view returns.
+    The store is resolved now, while the request is still current. Each
+    query's archive ``partitions`` are attached only while it runs, so a
+    stream can read more of them than can be attached at once.
+    """
+    return _iter_segments(get_pool(), segments)
+
+def _iter_segments(store_pool, segments):
+    conn = store_pool.acquire()
+    try:
+        for query, params, partitions in segments:
+            with attached(conn, partitions, store_pool.store):
+                cursor = conn.execute(query, params)
+                try:
+                    while True:
+                        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                        if not rows:
+                            break
+                        yield from rows
+                finally:
+                    # An archive can only be detached once no statement is reading it
+                    cursor.close()
+    finally:
+        store_pool.release(conn)
+
+def _buffered(pieces):
+    """Join small string pieces into CHUNK_SIZE-ish chunks"""
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+def encode_ndjson(records):
+    for record in records:
+        yield json.dumps(record, separators=(',', ':')) + '\n'
+
+def encode_csv(records, columns):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for record in records:
+        writer.writerow([record.get(column) for column in columns])
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate(0)
+    yield out.getvalue()
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def parse_export_format(args):
+    """Validate the ``format`` and ``compress`` query parameters"""
+    fmt = args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    compress = args.get('compress', '')
+    if compress not in ('', 'gzip'):
+        raise ValueError("compress must be 'gzip' if given")
+    return fmt, compress == 'gzip'
+
+def export_response(records, columns, fmt, compress, name):
+    """Stream records (dicts) as an NDJSON or CSV download, optionally gzipped"""
+    if fmt == 'csv':
+        chunks = _buffered(encode_csv(records, columns))
+    else:
+        chunks = _buffered(encode_ndjson(records))
+
+    filename = f"{name}.{fmt}"
+    mimetype = FORMATS[fmt]
+    if compress:
+        chunks = _gzipped(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    response = Response(chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
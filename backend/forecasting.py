@@ -0,0 +1,156 @@
+"""
+Vectorized per-product demand forecasting
+
+Every product is forecast in one pass over a (products x days) matrix of
+daily unit sales:
+
+* velocity     - exponentially weighted average of daily sales (units/day)
+* seasonality  - per-weekday index, so a product that sells mostly on
+                 weekends is projected that way
+* stockout     - first future day where projected cumulative demand
+                 reaches current stock
+* reorder qty  - projected demand over lead time + review period, plus
+                 safety stock, minus current stock
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+HISTORY_DAYS = 365
+MAX_HISTORY_DAYS = 730
+SMOOTHING_ALPHA = 0.1      # weight of the most recent day in the velocity average
+LEAD_TIME_DAYS = 7         # days between placing and receiving an order
+REVIEW_DAYS = 7            # days of demand each order should cover after arrival
+SERVICE_LEVEL_Z = 1.65     # ~95% chance of not running out during lead time
+PROJECTION_DAYS = 120      # horizon for days-to-stockout; beyond this it's reported as None
+SEASONALITY_MIN_WEEKS = 4  # weeks of history before weekday seasonality is fully trusted
+
+def build_daily_matrix(barcodes, rows, days):
+    """Build the (products x days) unit matrix from per-product rollup rows
+
+    Each row is (barcode, day offsets, units), the last two as the
+    comma-separated lists GROUP_CONCAT returns, so a product's whole history
+    arrives as one row and is parsed by NumPy rather than value by value.
+    Rows for barcodes not in ``barcodes`` and days outside the window are ignored.
+    """
+    index = {barcode: i for i, barcode in enumerate(barcodes)}
+    matrix = np.zeros((len(barcodes), days), dtype=np.float64)
+    rows = [row for row in rows if row[0] in index]
+    if not rows:
+        return matrix
+
+    offsets = np.fromstring(','.join(row[1] for row in rows), dtype=np.intp, sep=',')
+    units = np.fromstring(','.join(row[2] for row in rows), dtype=np.float64, sep=',')
+    lengths = np.fromiter((row[1].count(',') + 1 for row in rows), dtype=np.intp, count=len(rows))
+    product_idx = np.repeat(np.fromiter((index[row[0]] for row in rows), dtype=np.intp, count=len(rows)), lengths)
+
+    keep = (offsets >= 0) & (offsets < days)
+    np.add.at(matrix, (product_idx[keep], offsets[keep]), units[keep])
+    return matrix
+
+def smoothed_velocity(matrix, alpha=SMOOTHING_ALPHA):
+    """Exponentially weighted daily sales per product (most recent day weighted highest)"""
+    days = matrix.shape[1]
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1)
+    return matrix @ (weights / weights.sum())
+
+def weekday_index(matrix, start_day):
+    """Per-product multiplier for each weekday (Monday=0), averaging 1 across the week"""
+    products, days = matrix.shape
+    weekdays = (start_day.weekday() + np.arange(days)) % 7
+    onehot = np.zeros((days, 7))
+    onehot[np.arange(days), weekdays] = 1
+
+    per_weekday = (matrix @ onehot) / np.maximum(onehot.sum(axis=0), 1)
+    mean = per_weekday.mean(axis=1, keepdims=True)
+    index = np.divide(per_weekday, mean, out=np.ones_like(per_weekday), where=mean > 0)
+
+    # Shrink towards a flat week when there is little history to go on
+    trust = min(1.0, days / (7 * SEASONALITY_MIN_WEEKS))
+    return 1 + (index - 1) * trust
+
+def forecast(stock, matrix, start_day, today, lead_time=LEAD_TIME_DAYS, review=REVIEW_DAYS):
+    """Forecast every product at once
+
+    ``stock`` is a vector of current stock aligned with the matrix rows, whose
+    last column is ``today``. Returns a dict of per-product NumPy arrays.
+    """
+    stock = np.asarray(stock, dtype=np.float64)
+    velocity = smoothed_velocity(matrix)
+    seasonal = weekday_index(matrix, start_day)
+
+    # Projected demand for each of the next PROJECTION_DAYS days
+    future_weekdays = (today.weekday() + 1 + np.arange(PROJECTION_DAYS)) % 7
+    projected = velocity[:, None] * seasonal[:, future_weekdays]
+    cumulative = np.cumsum(projected, axis=1)
+
+    runs_out = cumulative >= stock[:, None]
+    will_run_out = runs_out.any(axis=1) & (velocity > 0)
+    days_to_stockout = np.where(will_run_out, runs_out.argmax(axis=1) + 1, -1)
+    days_to_stockout = np.where(stock <= 0, 0, days_to_stockout)
+
+    # Cover lead time plus the review period, with safety stock for lead-time variability
+    horizon = min(lead_time + review, PROJECTION_DAYS)
+    horizon_demand = cumulative[:, horizon - 1] if horizon > 0 else np.zeros_like(stock)
+    safety_stock = SERVICE_LEVEL_Z * matrix[:, -28:].std(axis=1) * np.sqrt(lead_time)
+    reorder_quantity = np.ceil(np.maximum(horizon_demand + safety_stock - stock, 0))
+
+    return {
+        "velocity": velocity,
+        "units_sold": matrix.sum(axis=1),
+        "days_to_stockout": days_to_stockout,
+        "reorder_quantity": reorder_quantity,
+        "alert": (days_to_stockout >= 0) & (days_to_stockout <= lead_time),
+    }
+
+def run(conn, history_days=HISTORY_DAYS, lead_time=LEAD_TIME_DAYS, today=None):
+    """Load daily sales from the sales_daily rollup and forecast every product in the catalog
+
+    Returns a list of per-product dicts, most urgent first.
+    """
+    # Sale timestamps are stored in UTC (CURRENT_TIMESTAMP)
+    today = today or datetime.utcnow().date()
+    start_day = today - timedelta(days=history_days - 1)
+
+    products = conn.execute("SELECT barcode, name, stock FROM products").fetchall()
+    if not products:
+        return []
+    barcodes = [product['barcode'] for product in products]
+
+    # One row per product, with day offsets computed by SQLite: building a
+    # Python row per rollup day costs more than the whole forecast
+    rows = conn.execute(
+        """
+        SELECT barcode,
+               GROUP_CONCAT(CAST(julianday(day) - julianday(?) AS INTEGER)),
+               GROUP_CONCAT(units)
+        FROM sales_daily
+        WHERE day >= ?
+        GROUP BY barcode
+        """,
+        (start_day.isoformat(), start_day.isoformat())
+    ).fetchall()
+
+    matrix = build_daily_matrix(barcodes, rows, history_days)
+    stock = [product['stock'] for product in products]
+    result = forecast(stock, matrix, start_day, today, lead_time=lead_time)
+
+    forecasts = []
+    for i, product in enumerate(products):
+        days_to_stockout = int(result['days_to_stockout'][i])
+        forecasts.append({
+            "barcode": product['barcode'],
+            "name": product['name'],
+            "current_stock": product['stock'],
+            "units_sold": int(result['units_sold'][i]),
+            "velocity": round(float(result['velocity'][i]), 3),
+            "days_to_stockout": days_to_stockout if days_to_stockout >= 0 else None,
+            "reorder_quantity": int(result['reorder_quantity'][i]),
+            "alert": bool(result['alert'][i]),
+        })
+
+    # Soonest stockout first; products not expected to run out go last, fastest sellers first
+    forecasts.sort(key=lambda f: (f['days_to_stockout'] is None,
+                                  f['days_to_stockout'] or 0, -f['velocity']))
+    return forecasts
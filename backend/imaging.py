@@ -0,0 +1,94 @@
+"""
+Barcode image processing: decoding frames to grayscale and finding barcodes
+
+Imports OpenCV, NumPy and pyzbar, so it is only loaded by instances that
+actually scan, on first use (see scanner.py).
+"""
+
+import cv2
+import numpy as np
+from pyzbar.pyzbar import decode
+
+# imdecode flags per downscale factor; JPEGs are reduced while decoding,
+# so a downscaled frame costs less than a full-resolution one
+GRAYSCALE_DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Downscale factor of the first, cheapest passes of the strategy ladder
+LADDER_SCALE = 2
+
+def decode_grayscale(image_bytes, scale=1, roi=None):
+    """Decode an encoded JPEG/PNG straight to a single-channel array
+
+    Cropping to ``roi`` returns a view, so no pixel data is copied here.
+    """
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), GRAYSCALE_DECODE_FLAGS[scale])
+    if image is None:
+        raise ValueError("Unsupported or corrupt image")
+
+    if roi:
+        height, width = image.shape
+        x, y, roi_width, roi_height = roi
+        image = image[int(y * height):int((y + roi_height) * height),
+                      int(x * width):int((x + roi_width) * width)]
+    return image
+
+def frame_hash(image_bytes):
+    """64-bit difference hash of a frame, for spotting near-identical frames
+
+    Uses the 1/8 reduced decode, so it is far cheaper than a barcode decode.
+    Returns None if the image can't be decoded.
+    """
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    tiny = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (tiny[:, 1:] > tiny[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def _threshold(image):
+    """Binarize with Otsu's threshold, which helps with glare and low contrast"""
+    return cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+def _sharpen(image):
+    """Unsharp mask, which helps with slightly out-of-focus frames"""
+    blurred = cv2.GaussianBlur(image, (0, 0), 3)
+    return cv2.addWeighted(image, 1.5, blurred, -0.5, 0)
+
+def _strategy_ladder(image_bytes, roi):
+    """Yield (strategy, image) pairs from cheapest to most expensive
+
+    Images are produced lazily so passes after the first hit cost nothing.
+    """
+    reduced = decode_grayscale(image_bytes, LADDER_SCALE, roi)
+    yield 'downscaled', reduced
+    yield 'threshold', _threshold(reduced)
+    yield 'sharpen', _sharpen(reduced)
+    yield 'full', decode_grayscale(image_bytes, 1, roi)
+
+def decode_frame(image_bytes, scale=None, roi=None):
+    """Find barcodes in an encoded frame
+
+    With ``scale`` set the frame is decoded once at that scale; otherwise
+    the strategy ladder is tried, stopping at the first pass that finds
+    anything. Runs inside a decoder process, so it takes and returns only
+    plain picklable values: a list of (data, type, strategy) tuples.
+    """
+    if scale:
+        passes = [('scale', decode_grayscale(image_bytes, scale, roi))]
+    else:
+        passes = _strategy_ladder(image_bytes, roi)
+
+    for strategy, image in passes:
+        found = decode(image)
+        if found:
+            return [(obj.data.decode('utf-8'), obj.type, strategy) for obj in found]
+    return []
+
+def decode_frames(frames, roi=None):
+    """Run the strategy ladder over several frames, one result list per frame"""
+    return [decode_frame(image_bytes, None, roi) for image_bytes in frames]
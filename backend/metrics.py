@@ -0,0 +1,133 @@
+"""
+Per-endpoint request metrics in Prometheus text format
+
+Requests are labelled by Flask endpoint (e.g. ``products.get_product``),
+which keeps label cardinality bounded regardless of URL parameters. Each
+worker process keeps its own counters, so with several gunicorn workers
+each scrape reports the worker that happened to answer it.
+"""
+
+import bisect
+import threading
+import time
+
+from flask import g, request
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class RequestMetrics:
+    """Thread-safe counters and histograms keyed by endpoint"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.in_flight = {}      # endpoint -> requests being served
+        self.statuses = {}       # (endpoint, method, status) -> count
+        self.latency = {}        # (endpoint, method) -> [bucket counts..., +Inf count, sum]
+        self.sql_queries = {}    # endpoint -> statements executed
+        self.sql_seconds = {}    # endpoint -> seconds spent executing them
+
+    def started(self, endpoint):
+        with self._lock:
+            self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + 1
+
+    def finished(self, endpoint, method, status, elapsed, sql_queries, sql_seconds):
+        bucket = bisect.bisect_left(self.buckets, elapsed)
+        with self._lock:
+            self.in_flight[endpoint] -= 1
+            key = (endpoint, method, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+            histogram = self.latency.get((endpoint, method))
+            if histogram is None:
+                histogram = self.latency[(endpoint, method)] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bucket] += 1
+            histogram[-1] += elapsed
+
+            if sql_queries:
+                self.sql_queries[endpoint] = self.sql_queries.get(endpoint, 0) + sql_queries
+                self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + sql_seconds
+
+    def render(self):
+        """The current values in Prometheus text exposition format"""
+        with self._lock:
+            in_flight = dict(self.in_flight)
+            statuses = dict(self.statuses)
+            latency = {key: list(value) for key, value in self.latency.items()}
+            sql_queries = dict(self.sql_queries)
+            sql_seconds = dict(self.sql_seconds)
+
+        lines = [
+            '# HELP billing_http_requests_in_flight Requests currently being served',
+            '# TYPE billing_http_requests_in_flight gauge',
+        ]
+        for endpoint, value in sorted(in_flight.items()):
+            lines.append(f'billing_http_requests_in_flight{{endpoint="{endpoint}"}} {value}')
+
+        lines += [
+            '# HELP billing_http_requests_total Requests served, by response status',
+            '# TYPE billing_http_requests_total counter',
+        ]
+        for (endpoint, method, status), value in sorted(statuses.items()):
+            lines.append(f'billing_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {value}')
+
+        lines += [
+            '# HELP billing_http_request_duration_seconds Request latency',
+            '# TYPE billing_http_request_duration_seconds histogram',
+        ]
+        for (endpoint, method), histogram in sorted(latency.items()):
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram[:-1]):
+                cumulative += count
+                lines.append(f'billing_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'billing_http_request_duration_seconds_sum{{{labels}}} {histogram[-1]:.6f}')
+            lines.append(f'billing_http_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+        lines += [
+            '# HELP billing_sql_queries_total SQL statements executed while serving requests',
+            '# TYPE billing_sql_queries_total counter',
+        ]
+        for endpoint, value in sorted(sql_queries.items()):
+            lines.append(f'billing_sql_queries_total{{endpoint="{endpoint}"}} {value}')
+
+        lines += [
+            '# HELP billing_sql_query_seconds_total Time spent executing SQL statements while serving requests',
+            '# TYPE billing_sql_query_seconds_total counter',
+        ]
+        for endpoint, value in sorted(sql_seconds.items()):
+            lines.append(f'billing_sql_query_seconds_total{{endpoint="{endpoint}"}} {value:.6f}')
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    request_metrics.started(_endpoint())
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+def _teardown_request(exc=None):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    request_metrics.finished(
+        _endpoint(),
+        request.method,
+        g.pop('metrics_status', 500),
+        time.perf_counter() - started,
+        g.get('sql_queries', 0),
+        g.get('sql_seconds', 0.0)
+    )
+
+def init_metrics(app):
+    """Record latency, status and SQL metrics for every request to app"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
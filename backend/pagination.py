@@ -0,0 +1,96 @@
+"""
+Keyset pagination helpers for timestamped history tables
+"""
+
+import base64
+from datetime import datetime
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Response header carrying the cursor for the next (older) page
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+def parse_limit(value):
+    """Parse the ``limit`` query parameter, capped at MAX_LIMIT"""
+    if value is None or value == '':
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be a positive integer")
+    if limit <= 0:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, MAX_LIMIT)
+
+def encode_cursor(timestamp, row_id):
+    """Encode the (timestamp, id) of the last row on a page as an opaque cursor"""
+    raw = f"{timestamp}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return timestamp, int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def parse_bound(value, name):
+    """Validate a date or datetime bound, returning it with an 'is date only' flag"""
+    for fmt, date_only in (('%Y-%m-%d', True), ('%Y-%m-%d %H:%M:%S', False), ('%Y-%m-%dT%H:%M:%S', False)):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S'), date_only
+        except ValueError:
+            continue
+    raise ValueError(f"{name} must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+
+def date_range_filters(args, column='timestamp'):
+    """Build WHERE clauses for the ``start``/``end`` query parameters
+
+    Both bounds are inclusive; a date-only ``end`` covers the whole day.
+    """
+    where, params = [], []
+    if args.get('start'):
+        start, _ = parse_bound(args['start'], 'start')
+        where.append(f"{column} >= ?")
+        params.append(start)
+    if args.get('end'):
+        end, date_only = parse_bound(args['end'], 'end')
+        if date_only:
+            where.append(f"{column} < datetime(?, '+1 day')")
+        else:
+            where.append(f"{column} <= ?")
+        params.append(end)
+    return where, params
+
+def fetch_page(conn, select, where, params, args, prefix=''):
+    """Run ``select`` newest-first with keyset pagination on (timestamp, id)
+
+    ``select`` is a SELECT ... FROM clause without WHERE/ORDER BY, ``where``
+    and ``params`` are the caller's filters. Date-range, ``cursor`` and
+    ``limit`` query parameters are applied here. Returns the rows of the
+    page and the cursor for the next page (None on the last page).
+    """
+    limit = parse_limit(args.get('limit'))
+    range_where, range_params = date_range_filters(args, f"{prefix}timestamp")
+    where = list(where) + range_where
+    params = list(params) + range_params
+
+    if args.get('cursor'):
+        timestamp, row_id = decode_cursor(args['cursor'])
+        where.append(f"({prefix}timestamp, {prefix}id) < (?, ?)")
+        params.extend([timestamp, row_id])
+
+    sql = select
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {prefix}timestamp DESC, {prefix}id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+    return rows, next_cursor
@@ -2,9 +2,27 @@
 Routes package for API endpoints
 """
 
-from .products import products_bp
-from .sales import sales_bp
-from .receipts import receipts_bp
-from .barcode import barcode_bp
+import importlib
+import time
 
-__all__ = ['products_bp', 'sales_bp', 'receipts_bp', 'barcode_bp']
\ No newline at end of file
+# Milliseconds spent importing each blueprint module, in load order. Shared
+# dependencies are charged to the first blueprint that imports them.
+IMPORT_TIMINGS = {}
+
+def _load_blueprint(module, name):
+    started = time.perf_counter()
+    blueprint = getattr(importlib.import_module(f'.{module}', __name__), name)
+    IMPORT_TIMINGS[name] = round((time.perf_counter() - started) * 1000, 2)
+    return blueprint
+
+products_bp = _load_blueprint('products', 'products_bp')
+sales_bp = _load_blueprint('sales', 'sales_bp')
+receipts_bp = _load_blueprint('receipts', 'receipts_bp')
+barcode_bp = _load_blueprint('barcode', 'barcode_bp')
+checkout_bp = _load_blueprint('checkout', 'checkout_bp')
+health_bp = _load_blueprint('health', 'health_bp')
+metrics_bp = _load_blueprint('metrics', 'metrics_bp')
+stores_bp = _load_blueprint('stores', 'stores_bp')
+events_bp = _load_blueprint('events', 'events_bp')
+
+__all__ = ['products_bp', 'sales_bp', 'receipts_bp', 'barcode_bp', 'checkout_bp', 'health_bp', 'metrics_bp', 'stores_bp', 'events_bp', 'IMPORT_TIMINGS']
@@ -3,69 +3,153 @@ Barcode scanning API routes
 """
 
 from flask import Blueprint, request, jsonify
-from database import get_db_connection
+from catalog_cache import get_cached_product
+from scanner import decoder_pool, DecoderBusy, DecodeTimeout, SCALES, MAX_BATCH_FRAMES, SCANNING_ENABLED
+from scan_cache import scan_cache
 import base64
-import cv2
-import numpy as np
-from pyzbar.pyzbar import decode
-import io
-from PIL import Image
 
 barcode_bp = Blueprint('barcode', __name__)
 
+# Content types accepted as a raw (non-JSON) image body
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+def read_image_bytes():
+    """Get the encoded image from a multipart upload, a raw body or a base64 JSON field"""
+    if 'image' in request.files:
+        return request.files['image'].read()
+    
+    if request.mimetype in RAW_IMAGE_TYPES:
+        return request.get_data()
+    
+    data = request.get_json(silent=True)
+    if not data or 'image' not in data:
+        return None
+    
+    return decode_base64_image(data['image'])
+
+def read_image_frames():
+    """Get the encoded frames of a batch scan from multipart files or a base64 JSON list"""
+    if request.files:
+        return [upload.read() for upload in request.files.getlist('images') + request.files.getlist('image')]
+    
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('images'), list):
+        return []
+    return [decode_base64_image(image_data) for image_data in data['images']]
+
+def decode_base64_image(image_data):
+    """Decode a base64 image, with or without a data URL prefix"""
+    if image_data.startswith('data:image'):
+        # Remove data URL prefix if present
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+def parse_scan_options(values):
+    """Parse the ``scale`` and ``roi`` options of a scan request
+
+    ``scale`` is a downscale factor (1, 2, 4 or 8) for a single decode pass;
+    without it the decoder's strategy ladder is used. ``roi`` is the region to
+    scan as ``x,y,width,height`` fractions of the frame, e.g. ``0.2,0.3,0.6,0.4``.
+    """
+    scale = None
+    if values.get('scale'):
+        scale = int(values['scale'])
+        if scale not in SCALES:
+            raise ValueError("scale must be one of 1, 2, 4 or 8")
+    
+    roi = None
+    if values.get('roi'):
+        roi = tuple(float(part) for part in values['roi'].split(','))
+        x, y, width, height = roi  # raises ValueError unless exactly four parts
+        if not (0 <= x < 1 and 0 <= y < 1 and 0 < width <= 1 - x and 0 < height <= 1 - y):
+            raise ValueError("roi must be x,y,width,height fractions within the frame")
+    return scale, roi
+
+def scan_session_id(options):
+    """Identify the scanning session: an explicit ``session`` option, the X-Scan-Session header, or the client address"""
+    return options.get('session') or request.headers.get('X-Scan-Session') or request.remote_addr
+
+@barcode_bp.before_request
+def require_scanning():
+    """Refuse image scans on instances with scanning disabled"""
+    if request.endpoint in ('barcode.scan_barcode', 'barcode.scan_barcode_batch') and not SCANNING_ENABLED:
+        return jsonify({"error": "Barcode scanning is disabled on this server"}), 503
+
 @barcode_bp.route('/barcode/scan', methods=['POST'])
 def scan_barcode():
-    """Scan barcode from image data"""
+    """Scan barcode from image data
+
+    Accepts a raw JPEG/PNG body, a multipart upload with an ``image`` file,
+    or JSON with a base64 ``image`` (data URL) field. Optional ``scale`` and
+    ``roi`` query or form parameters reduce the work per frame. Without
+    ``scale``, cheap downscaled passes are tried before full resolution.
+    
+    Frames nearly identical to a recent frame of the same session reuse its
+    result (``cached``), and the same barcode scanned again within the
+    debounce window is flagged with ``repeat`` so the till doesn't add it twice.
+    """
     try:
-        data = request.get_json()
+        image_bytes = read_image_bytes()
         
-        if not data or 'image' not in data:
+        if not image_bytes:
             return jsonify({"error": "No image data provided"}), 400
         
-        # Decode base64 image
-        image_data = data['image']
-        if image_data.startswith('data:image'):
-            # Remove data URL prefix if present
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64 to image
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to OpenCV format
-        open_cv_image = np.array(image)
-        open_cv_image = open_cv_image[:, :, ::-1].copy()  # Convert RGB to BGR
-        
-        # Decode barcodes
-        decoded_objects = decode(open_cv_image)
+        try:
+            options = request.args.to_dict()
+            options.update(request.form.to_dict())
+            scale, roi = parse_scan_options(options)
+            session_id = scan_session_id(options)
+            
+            # Reuse the result of a near-identical recent frame
+            cache_key = (scale, roi)
+            frame_key = decoder_pool.frame_hash(image_bytes)
+            decoded_objects = None
+            if frame_key is not None:
+                decoded_objects = scan_cache.lookup(session_id, cache_key, frame_key)
+            cached = decoded_objects is not None
+            
+            if not cached:
+                # Decode barcodes on the decoder pool
+                decoded_objects = decoder_pool.decode(image_bytes, scale, roi)
+                if frame_key is not None:
+                    scan_cache.store(session_id, cache_key, frame_key, decoded_objects)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except DecoderBusy:
+            response = jsonify({"error": "Scanner busy, frame dropped", "busy": True})
+            response.headers['Retry-After'] = '1'
+            return response, 429
+        except DecodeTimeout:
+            return jsonify({"error": "Barcode decoding timed out"}), 503
         
         if not decoded_objects:
             return jsonify({"error": "No barcode detected"}), 404
         
         # Get the first detected barcode
-        barcode_data = decoded_objects[0].data.decode('utf-8')
-        barcode_type = decoded_objects[0].type
+        barcode_data, barcode_type, strategy = decoded_objects[0]
+        repeat = scan_cache.is_repeat(session_id, barcode_data)
         
-        # Look up product in database
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM products WHERE barcode = ?", (barcode_data,))
-        product = cursor.fetchone()
-        conn.close()
+        # Look up product in the catalog cache
+        product = get_cached_product(barcode_data)
         
         if product:
-            product_dict = dict(product)
             return jsonify({
                 "success": True,
                 "barcode": barcode_data,
                 "type": barcode_type,
-                "product": product_dict
+                "strategy": strategy,
+                "cached": cached,
+                "repeat": repeat,
+                "product": product
             })
         else:
             return jsonify({
                 "success": True,
                 "barcode": barcode_data,
                 "type": barcode_type,
+                "strategy": strategy,
+                "cached": cached,
+                "repeat": repeat,
                 "message": "Product not found in database",
                 "product": None
             })
@@ -73,19 +157,80 @@ def scan_barcode():
     except Exception as e:
         return jsonify({"error": f"Barcode scanning failed: {str(e)}"}), 500
 
+@barcode_bp.route('/barcode/scan/batch', methods=['POST'])
+def scan_barcode_batch():
+    """Scan several frames of the same item in one request
+
+    Accepts multipart ``images`` files or JSON with a base64 ``images`` list,
+    plus an optional ``roi``. Every frame goes through the strategy ladder and
+    all distinct barcodes found are returned with the frames they appeared in.
+    """
+    try:
+        try:
+            frames = [frame for frame in read_image_frames() if frame]
+            options = request.args.to_dict()
+            options.update(request.form.to_dict())
+            _, roi = parse_scan_options(options)
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({"error": f"Invalid scan request: {str(e)}"}), 400
+        
+        if not frames:
+            return jsonify({"error": "No image data provided"}), 400
+        if len(frames) > MAX_BATCH_FRAMES:
+            return jsonify({"error": f"At most {MAX_BATCH_FRAMES} frames per request"}), 400
+        
+        try:
+            results = decoder_pool.decode_batch(frames, roi)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except DecoderBusy:
+            response = jsonify({"error": "Scanner busy, frames dropped", "busy": True})
+            response.headers['Retry-After'] = '1'
+            return response, 429
+        except DecodeTimeout:
+            return jsonify({"error": "Barcode decoding timed out"}), 503
+        
+        # Merge results across frames, keeping the order of first appearance
+        barcodes = {}
+        for frame_index, decoded_objects in enumerate(results):
+            for barcode_data, barcode_type, strategy in decoded_objects:
+                if barcode_data not in barcodes:
+                    barcodes[barcode_data] = {
+                        "barcode": barcode_data,
+                        "type": barcode_type,
+                        "strategy": strategy,
+                        "frames": [],
+                        "product": get_cached_product(barcode_data)
+                    }
+                if frame_index not in barcodes[barcode_data]['frames']:
+                    barcodes[barcode_data]['frames'].append(frame_index)
+        
+        if not barcodes:
+            return jsonify({"error": "No barcode detected", "frames": len(frames)}), 404
+        
+        return jsonify({
+            "success": True,
+            "frames": len(frames),
+            "barcodes": list(barcodes.values())
+        })
+    
+    except Exception as e:
+        return jsonify({"error": f"Barcode scanning failed: {str(e)}"}), 500
+
+@barcode_bp.route('/barcode/scan/cache', methods=['GET'])
+def get_scan_cache_stats():
+    """Get duplicate-frame cache statistics for this process"""
+    return jsonify(scan_cache.stats())
+
 @barcode_bp.route('/barcode/validate/<barcode>', methods=['GET'])
 def validate_barcode(barcode):
     """Validate if a barcode exists in the database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products WHERE barcode = ?", (barcode,))
-    product = cursor.fetchone()
-    conn.close()
+    product = get_cached_product(barcode)
     
     if product:
         return jsonify({
             "valid": True,
-            "product": dict(product)
+            "product": product
         })
     else:
         return jsonify({
@@ -0,0 +1,129 @@
+"""
+Checkout API routes for processing a whole basket in one transaction
+"""
+
+from flask import Blueprint, request, jsonify
+from database import get_db_connection
+from catalog_cache import product_cache
+from .products import fetch_products
+from .receipts import insert_receipt_items
+import uuid
+
+checkout_bp = Blueprint('checkout', __name__)
+
+@checkout_bp.route('/checkout', methods=['POST'])
+def checkout():
+    """Record a complete basket: receipt, sale lines and stock decrements
+
+    Lines whose stock is insufficient reject the whole checkout with 409,
+    unless ``allow_partial`` is set, in which case they are filled with
+    whatever stock remains (lines with no stock at all are dropped).
+    """
+    data = request.get_json()
+
+    required_fields = ['items', 'payment_method', 'payment_status', 'customer_name', 'customer_phone']
+    if not data or not all(key in data for key in required_fields):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    # Merge repeated barcodes so each product is checked and decremented once
+    requested = {}
+    try:
+        for item in data['items']:
+            if not isinstance(item, dict):
+                raise TypeError
+            quantity = int(item.get('quantity', 1))
+            if quantity <= 0:
+                return jsonify({"error": f"Invalid quantity for barcode {item.get('barcode')}"}), 400
+            requested[str(item['barcode'])] = requested.get(str(item['barcode']), 0) + quantity
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Each item needs a barcode and an integer quantity"}), 400
+
+    if not requested:
+        return jsonify({"error": "Cart is empty"}), 400
+
+    allow_partial = bool(data.get('allow_partial', False))
+    conn = get_db_connection()
+
+    try:
+        # Take the write lock up front so stock cannot change between the
+        # availability check and the decrement
+        conn.execute("BEGIN IMMEDIATE")
+
+        products = fetch_products(conn, requested, "barcode, name, price, stock")
+
+        lines = []
+        rejected = []
+        for barcode, quantity in requested.items():
+            product = products.get(barcode)
+            if product is None:
+                rejected.append({"barcode": barcode, "requested": quantity, "available": 0,
+                                 "reason": "Product not found"})
+                continue
+
+            filled = quantity
+            if product['stock'] < quantity:
+                rejected.append({"barcode": barcode, "requested": quantity, "available": product['stock'],
+                                 "reason": "Insufficient stock"})
+                if not allow_partial:
+                    continue
+                filled = product['stock']
+
+            if filled > 0:
+                lines.append({
+                    "barcode": barcode,
+                    "name": product['name'],
+                    "quantity": filled,
+                    "price": product['price'],
+                    "subtotal": product['price'] * filled
+                })
+
+        if (rejected and not allow_partial) or not lines:
+            conn.rollback()
+            return jsonify({"error": "Some items could not be fulfilled", "rejected": rejected}), 409
+
+        total_amount = sum(line['subtotal'] for line in lines)
+        try:
+            amount_paid = float(data.get('amount_paid', total_amount))
+        except (TypeError, ValueError):
+            conn.rollback()
+            return jsonify({"error": "Invalid amount paid"}), 400
+        change_amount = max(0, amount_paid - total_amount)
+        receipt_id = str(uuid.uuid4())
+
+        conn.execute(
+            "INSERT INTO receipts (receipt_id, items, total_amount, payment_method, payment_status, customer_name, customer_phone, amount_paid, change_amount) VALUES (?, '[]', ?, ?, ?, ?, ?, ?, ?)",
+            (receipt_id, total_amount,
+             data['payment_method'], data['payment_status'], data['customer_name'], data['customer_phone'],
+             amount_paid, change_amount)
+        )
+
+        insert_receipt_items(conn, receipt_id, lines)
+
+        # The sales table holds one row per unit sold
+        conn.executemany(
+            "INSERT INTO sales (barcode, name, price) VALUES (?, ?, ?)",
+            [(line['barcode'], line['name'], line['price'])
+             for line in lines for _ in range(line['quantity'])]
+        )
+
+        conn.executemany(
+            "UPDATE products SET stock = stock - ? WHERE barcode = ?",
+            [(line['quantity'], line['barcode']) for line in lines]
+        )
+
+        conn.commit()
+        product_cache.invalidate(*(line['barcode'] for line in lines))
+
+        return jsonify({
+            "message": "Checkout completed successfully",
+            "receipt_id": receipt_id,
+            "items": lines,
+            "total": total_amount,
+            "amount_paid": amount_paid,
+            "change": change_amount,
+            "rejected": rejected
+        }), 201
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,35 @@
+"""
+Catalog change events API route (server-sent events)
+"""
+
+from flask import Blueprint, Response, request, jsonify
+from database import get_pool
+from events import open_stream, TooManyStreams
+
+events_bp = Blueprint('events', __name__)
+
+@events_bp.route('/events', methods=['GET'])
+def stream_events():
+    """Stream product create/update/delete and stock changes as server-sent events
+
+    Resume with the ``Last-Event-ID`` header (sent automatically by
+    EventSource on reconnect) or ``?after=<seq>``; without either only
+    changes made from now on are sent.
+    """
+    after = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        after = int(after) if after is not None else None
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID/after must be an event sequence number"}), 400
+    
+    try:
+        stream = open_stream(get_pool(), after)
+    except TooManyStreams:
+        response = jsonify({"error": "Too many event streams open, retry shortly"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # stop nginx buffering the stream
+    return response
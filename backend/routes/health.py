@@ -0,0 +1,45 @@
+"""
+Health and readiness API routes for process supervisors and load balancers
+"""
+
+from flask import Blueprint, jsonify
+import sys
+from database import fan_out, MIGRATIONS, STORE_IDS
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/health', methods=['GET'])
+def health():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({"status": "ok"})
+
+@health_bp.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: every store's database is reachable and fully migrated"""
+    try:
+        versions = fan_out(lambda conn, store: conn.execute("PRAGMA user_version").fetchone()[0])
+    except Exception as e:
+        return jsonify({"status": "unavailable", "error": str(e)}), 503
+    
+    version = min(versions.values())
+    body = {"schema_version": version}
+    if STORE_IDS:
+        body["stores"] = versions
+    
+    if version < len(MIGRATIONS):
+        return jsonify({"status": "migrating", **body}), 503
+    
+    return jsonify({"status": "ready", **body})
+
+
+# Heavy optional dependencies that should only be loaded by features that use them
+OPTIONAL_MODULES = ['cv2', 'numpy', 'pyzbar']
+
+@health_bp.route('/startup', methods=['GET'])
+def startup_report():
+    """Import cost of each blueprint and which optional heavy modules are loaded"""
+    from routes import IMPORT_TIMINGS
+    return jsonify({
+        "blueprint_import_ms": IMPORT_TIMINGS,
+        "optional_modules_loaded": {name: name in sys.modules for name in OPTIONAL_MODULES}
+    })
\ No newline at end of file
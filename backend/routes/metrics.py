@@ -0,0 +1,13 @@
+"""
+Metrics API route for Prometheus scraping
+"""
+
+from flask import Blueprint, Response
+from metrics import request_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Request latency, status, in-flight and SQL metrics in Prometheus text format"""
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
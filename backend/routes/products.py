@@ -2,33 +2,115 @@
 Products API routes
 """
 
-from flask import Blueprint, request, jsonify
-from database import get_db_connection
+from flask import Blueprint, Response, request, jsonify
+from database import current_store, get_db_connection
+from catalog_cache import get_cached_product, product_cache
+from events import catalog_changes, latest_seq, CATALOG_VERSION_HEADER
+from search import search_products, vocabulary, DEFAULT_LIMIT as SEARCH_DEFAULT_LIMIT, MAX_LIMIT as SEARCH_MAX_LIMIT
+import csv
+import io
 
 products_bp = Blueprint('products', __name__)
 
+# Rows per IN (...) lookup, well under SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+MAX_BULK_ROWS = 50000
+
+def fetch_products(conn, barcodes, columns="barcode, stock"):
+    """Map barcode -> row of the given columns for the given barcodes that exist
+
+    Looked up LOOKUP_CHUNK_SIZE barcodes at a time; columns must include barcode.
+    """
+    barcodes = list(dict.fromkeys(barcodes))
+    products = {}
+    for i in range(0, len(barcodes), LOOKUP_CHUNK_SIZE):
+        chunk = barcodes[i:i + LOOKUP_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        for row in conn.execute(f"SELECT {columns} FROM products WHERE barcode IN ({placeholders})", chunk):
+            products[row['barcode']] = row
+    return products
+
+def fetch_stock(conn, barcodes):
+    """Map barcode -> current stock for the given barcodes that exist"""
+    return {barcode: row['stock'] for barcode, row in fetch_products(conn, barcodes).items()}
+
+def read_bulk_rows():
+    """Get product rows from a JSON array, a CSV upload (``file``) or a text/csv body"""
+    if 'file' in request.files:
+        text = request.files['file'].read().decode('utf-8-sig')
+        return list(csv.DictReader(io.StringIO(text)))
+    if request.mimetype == 'text/csv':
+        return list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('products')
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of products or a CSV upload")
+    return data
+
 @products_bp.route('/products', methods=['GET'])
 def get_products():
-    """Get all products"""
+    """Get all products, or only what changed since a catalog version
+
+    Every response carries the catalog version in X-Catalog-Version (and in
+    the ETag of the full list, so an unchanged catalog is answered with 304).
+    ``?since=<version>`` returns ``{"version", "changed", "deleted"}`` instead
+    of the full list, or 410 if that version is too old to diff against.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products ORDER BY name")
-    products = cursor.fetchall()
-    conn.close()
+    # Read the version first: a write landing before the product query then
+    # only makes the list newer than its version, and the next delta repeats it
+    version = latest_seq(conn)
     
-    return jsonify([dict(product) for product in products])
+    if request.args.get('since') is not None:
+        try:
+            since = int(request.args['since'])
+        except ValueError:
+            return jsonify({"error": "since must be a catalog version number"}), 400
+        try:
+            changed, deleted = catalog_changes(conn, since, version)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 410
+        response = jsonify({"version": version, "changed": changed, "deleted": deleted})
+        response.headers[CATALOG_VERSION_HEADER] = str(version)
+        return response
+    
+    etag = f"{current_store()}-{version}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM products ORDER BY name")
+        products = cursor.fetchall()
+        response = jsonify([dict(product) for product in products])
+    
+    response.set_etag(etag)
+    response.headers[CATALOG_VERSION_HEADER] = str(version)
+    # Let clients keep the list but check the version before reusing it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@products_bp.route('/products/search', methods=['GET'])
+def search_catalog():
+    """Find products by name (prefix and typo tolerant) or barcode prefix
+
+    Query parameters: ``q`` and ``limit`` (default 20, at most 100).
+    """
+    query = request.args.get('q', '')
+    try:
+        limit = max(1, min(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    
+    return jsonify(search_products(get_db_connection(), query, limit))
 
 @products_bp.route('/products/<barcode>', methods=['GET'])
 def get_product(barcode):
     """Get a specific product by barcode"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products WHERE barcode = ?", (barcode,))
-    product = cursor.fetchone()
-    conn.close()
+    product = get_cached_product(barcode)
     
     if product:
-        return jsonify(dict(product))
+        return jsonify(product)
     else:
         return jsonify({"error": "Product not found"}), 404
 
@@ -47,7 +129,6 @@ def add_product():
         # Check if product already exists
         cursor.execute("SELECT * FROM products WHERE barcode = ?", (data['barcode'],))
         if cursor.fetchone():
-            conn.close()
             return jsonify({"error": "Product with this barcode already exists"}), 400
         
         # Insert new product
@@ -57,7 +138,8 @@ def add_product():
         )
         
         conn.commit()
-        conn.close()
+        product_cache.invalidate(data['barcode'])
+        vocabulary.invalidate()
         
         return jsonify({"message": "Product added successfully"}), 201
     
@@ -77,7 +159,6 @@ def update_product(barcode):
     # Check if product exists
     cursor.execute("SELECT * FROM products WHERE barcode = ?", (barcode,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "Product not found"}), 404
     
     try:
@@ -101,8 +182,10 @@ def update_product(barcode):
             query = f"UPDATE products SET {', '.join(update_fields)} WHERE barcode = ?"
             cursor.execute(query, update_values)
             conn.commit()
+            product_cache.invalidate(barcode)
+            if 'name' in data:
+                vocabulary.invalidate()
         
-        conn.close()
         return jsonify({"message": "Product updated successfully"})
     
     except ValueError:
@@ -120,12 +203,142 @@ def delete_product(barcode):
     cursor.execute("SELECT * FROM products WHERE barcode = ?", (barcode,))
     product = cursor.fetchone()
     if not product:
-        conn.close()
         return jsonify({"error": "Product not found"}), 404
     
     # Delete product
     cursor.execute("DELETE FROM products WHERE barcode = ?", (barcode,))
     conn.commit()
-    conn.close()
+    product_cache.invalidate(barcode)
+    vocabulary.invalidate()
+    
+    return jsonify({"message": "Product deleted successfully"})
+
+@products_bp.route('/catalog/cache', methods=['GET'])
+def get_cache_stats():
+    """Get barcode lookup cache statistics"""
+    return jsonify(product_cache.stats())
+
+@products_bp.route('/products/bulk', methods=['POST'])
+def bulk_upsert_products():
+    """Create or update many products in one transaction
+
+    Accepts a JSON array (or {"products": [...]}) of objects with barcode,
+    name, price and stock, or a CSV file with those column headers. Valid
+    rows are upserted together; invalid rows, and later rows repeating a
+    barcode, are reported and skipped.
+    """
+    try:
+        rows = read_bulk_rows()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if not rows:
+        return jsonify({"error": "No products provided"}), 400
+    if len(rows) > MAX_BULK_ROWS:
+        return jsonify({"error": f"At most {MAX_BULK_ROWS} products per request"}), 400
+    
+    results = []
+    valid = {}
+    first_row = {}
+    for index, row in enumerate(rows):
+        try:
+            # None is a JSON null, or a field DictReader filled in for a short CSV row
+            if row['barcode'] is None or row['name'] is None:
+                raise ValueError
+            barcode = str(row['barcode']).strip()
+            name = str(row['name']).strip()
+            if not barcode or not name:
+                raise ValueError
+            product = (barcode, name, float(row['price']), int(row['stock']))
+        except (KeyError, TypeError, ValueError):
+            results.append({"row": index, "barcode": row.get('barcode') if isinstance(row, dict) else None,
+                            "status": "error", "error": "Missing or invalid barcode, name, price or stock"})
+            continue
+        if barcode in first_row:
+            results.append({"row": index, "barcode": barcode, "status": "error",
+                            "error": f"Barcode repeats row {first_row[barcode]}; only the first is applied"})
+            continue
+        first_row[barcode] = index
+        valid[barcode] = product
+        results.append({"row": index, "barcode": barcode, "status": None})
+    
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        existing = fetch_stock(conn, valid)
+        conn.executemany(
+            """
+            INSERT INTO products (barcode, name, price, stock) VALUES (?, ?, ?, ?)
+            ON CONFLICT (barcode) DO UPDATE SET
+                name = excluded.name, price = excluded.price, stock = excluded.stock
+            """,
+            valid.values()
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    
+    product_cache.invalidate(*valid)
+    vocabulary.invalidate()
+    
+    for result in results:
+        if result['status'] is None:
+            result['status'] = "updated" if result['barcode'] in existing else "created"
+    
+    summary = {status: sum(1 for r in results if r['status'] == status) for status in ("created", "updated", "error")}
+    return jsonify({**summary, "results": results})
+
+@products_bp.route('/stock/adjust', methods=['POST'])
+def adjust_stock():
+    """Apply many stock deltas in one transaction
+
+    Takes a JSON array (or {"adjustments": [...]}) of {barcode, delta}.
+    Adjustments for unknown barcodes, or that would make stock negative,
+    are rejected individually; the rest are applied together.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('adjustments')
+    if not isinstance(data, list) or not data:
+        return jsonify({"error": "Expected a JSON array of {barcode, delta}"}), 400
+    
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        stock = fetch_stock(conn, [str(item.get('barcode')) for item in data if isinstance(item, dict)])
+        
+        results = []
+        deltas = {}
+        for index, item in enumerate(data):
+            try:
+                barcode = str(item['barcode'])
+                delta = int(item['delta'])
+            except (KeyError, TypeError, ValueError):
+                results.append({"row": index, "status": "error", "error": "Missing or invalid barcode or delta"})
+                continue
+            
+            if barcode not in stock:
+                results.append({"row": index, "barcode": barcode, "status": "error", "error": "Product not found"})
+            elif stock[barcode] + delta < 0:
+                results.append({"row": index, "barcode": barcode, "status": "error",
+                                "error": "Insufficient stock", "stock": stock[barcode]})
+            else:
+                # Later rows for the same barcode see the effect of earlier ones
+                stock[barcode] += delta
+                deltas[barcode] = deltas.get(barcode, 0) + delta
+                results.append({"row": index, "barcode": barcode, "status": "applied", "stock": stock[barcode]})
+        
+        conn.executemany(
+            "UPDATE products SET stock = stock + ? WHERE barcode = ?",
+            [(delta, barcode) for barcode, delta in deltas.items() if delta]
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    
+    product_cache.invalidate(*deltas)
     
-    return jsonify({"message": "Product deleted successfully"})
\ No newline at end of file
+    applied = sum(1 for r in results if r['status'] == "applied")
+    return jsonify({"applied": applied, "errors": len(results) - applied, "results": results})
\ No newline at end of file
@@ -3,21 +3,78 @@ Receipts API routes for storing and managing transaction receipts
 """
 
 from flask import Blueprint, request, jsonify
-from database import get_db_connection
+from database import get_db_connection, receipt_item_rows
+from pagination import fetch_page, date_range_filters, NEXT_CURSOR_HEADER
+from export import iter_segments, export_response, parse_export_format
+from archive import (attached, delete_archived_receipt, find_receipt_partition, history_table,
+                     listing_partitions, partition_table, partitions_for)
 import json
 import uuid
 from datetime import datetime
 
 receipts_bp = Blueprint('receipts', __name__)
 
+# Receipt columns returned by the API. The legacy ``items`` blob is superseded by
+# receipt_items, and only read for receipts whose blob the migration couldn't move.
+RECEIPT_COLUMNS = "id, receipt_id, items, total_amount, payment_method, payment_status, customer_name, customer_phone, amount_paid, change_amount, timestamp"
+
+def insert_receipt_items(conn, receipt_id, items):
+    """Store the line items of a receipt"""
+    conn.executemany(
+        "INSERT INTO receipt_items (receipt_id, barcode, name, quantity, unit_price, subtotal) VALUES (?, ?, ?, ?, ?, ?)",
+        receipt_item_rows(receipt_id, items)
+    )
+
+def _item_dict(row):
+    """Map a receipt_items row to the item shape the frontend expects"""
+    return {
+        "barcode": row['barcode'],
+        "name": row['name'],
+        "quantity": row['quantity'],
+        "price": row['unit_price'],
+        "subtotal": row['subtotal']
+    }
+
+def _legacy_items(blob):
+    """Best-effort read of a legacy items blob left in place by the receipt_items migration"""
+    try:
+        items = json.loads(blob or '[]')
+    except ValueError:
+        return []
+    if not isinstance(items, list):
+        return []
+    return [
+        {
+            "barcode": item.get('barcode'),
+            "name": item.get('name'),
+            "quantity": item.get('quantity', 1),
+            "price": item.get('price'),
+            "subtotal": item.get('subtotal')
+        }
+        for item in items if isinstance(item, dict)
+    ]
+
+def _receipt_dict(receipt, items):
+    """Map a receipt row and its items to frontend field names"""
+    receipt_dict = dict(receipt)
+    legacy_items = receipt_dict.pop('items', '[]')
+    receipt_dict['items'] = items or _legacy_items(legacy_items)
+    receipt_dict['total'] = receipt_dict.pop('total_amount', 0)
+    receipt_dict['change'] = receipt_dict.pop('change_amount', 0)
+    receipt_dict['created_at'] = receipt_dict.pop('timestamp', '')
+    return receipt_dict
+
 @receipts_bp.route('/receipts', methods=['POST'])
 def create_receipt():
     """Create and store a new receipt"""
     data = request.get_json()
     
     required_fields = ['items', 'total', 'payment_method', 'payment_status', 'customer_name', 'customer_phone']
-    if not all(key in data for key in required_fields):
+    if not data or not all(key in data for key in required_fields):
         return jsonify({"error": "Missing required fields"}), 400
+    if not isinstance(data['items'], list) or not all(
+            isinstance(item, dict) and isinstance(item.get('name'), str) for item in data['items']):
+        return jsonify({"error": "items must be a list of objects with a name"}), 400
     
     try:
         conn = get_db_connection()
@@ -34,65 +91,180 @@ def create_receipt():
         change_amount = max(0, amount_paid - total_amount)
 
         cursor.execute(
-            "INSERT INTO receipts (receipt_id, items, total_amount, payment_method, payment_status, customer_name, customer_phone, amount_paid, change_amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (receipt_id, json.dumps(data['items']), total_amount, 
+            "INSERT INTO receipts (receipt_id, items, total_amount, payment_method, payment_status, customer_name, customer_phone, amount_paid, change_amount) VALUES (?, '[]', ?, ?, ?, ?, ?, ?, ?)",
+            (receipt_id, total_amount, 
              data['payment_method'], data['payment_status'], customer_name, customer_phone, amount_paid, change_amount)
         )
+        insert_receipt_items(conn, receipt_id, data['items'])
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             "message": "Receipt created successfully",
             "receipt_id": receipt_id
         }), 201
     
+    except (ValueError, TypeError, KeyError):
+        conn.rollback()
+        return jsonify({"error": "Invalid amount or receipt item"}), 400
     except Exception as e:
+        conn.rollback()
         return jsonify({"error": str(e)}), 500
 
 @receipts_bp.route('/receipts', methods=['GET'])
 def get_receipts():
-    """Get all receipts"""
+    """Get receipts, newest first, one page at a time
+
+    Query parameters: ``limit``, ``cursor`` (from the X-Next-Cursor header
+    of the previous page), ``start``/``end`` dates and ``payment_method``.
+    Archived receipts in the range are read too.
+    """
+    where, params = [], []
+    if request.args.get('payment_method'):
+        where.append("payment_method = ?")
+        params.append(request.args['payment_method'])
+    
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM receipts ORDER BY timestamp DESC")
-    receipts = cursor.fetchall()
-    conn.close()
+    try:
+        partitions, resume_cursor = listing_partitions(conn, request.args)
+        with attached(conn, partitions):
+            receipts, next_cursor = fetch_page(conn, f"SELECT {RECEIPT_COLUMNS} FROM {history_table('receipts', partitions)}",
+                                               where, params, request.args)
+            
+            # Load the items for the whole page in one query
+            items_by_receipt = {receipt['receipt_id']: [] for receipt in receipts}
+            if items_by_receipt:
+                placeholders = ', '.join('?' * len(items_by_receipt))
+                rows = conn.execute(
+                    f"SELECT * FROM {history_table('receipt_items', partitions)} WHERE receipt_id IN ({placeholders}) ORDER BY id",
+                    list(items_by_receipt)
+                ).fetchall()
+                for row in rows:
+                    items_by_receipt[row['receipt_id']].append(_item_dict(row))
+        next_cursor = next_cursor or resume_cursor
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    receipts_list = [_receipt_dict(receipt, items_by_receipt[receipt['receipt_id']]) for receipt in receipts]
     
-    # Parse items from JSON string and map fields to frontend expectations
-    receipts_list = []
+    response = jsonify(receipts_list)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+# CSV exports have one row per receipt line, with the receipt columns repeated
+RECEIPT_EXPORT_COLUMNS = ['receipt_id', 'created_at', 'payment_method', 'payment_status', 'customer_name',
+                          'customer_phone', 'total', 'amount_paid', 'change',
+                          'item_barcode', 'item_name', 'item_quantity', 'item_price', 'item_subtotal']
+
+def _export_receipts(rows):
+    """Group consecutive joined rows into receipts with their items"""
+    current = None
+    for row in rows:
+        if current is None or current['receipt_id'] != row['receipt_id']:
+            if current is not None:
+                yield current
+            current = _receipt_dict({key: row[key] for key in row.keys() if not key.startswith('item_')}, [])
+        if row['item_name'] is not None:
+            current['items'].append({
+                "barcode": row['item_barcode'],
+                "name": row['item_name'],
+                "quantity": row['item_quantity'],
+                "price": row['item_unit_price'],
+                "subtotal": row['item_subtotal']
+            })
+    if current is not None:
+        yield current
+
+def _flatten_receipt_lines(receipts):
     for receipt in receipts:
-        receipt_dict = dict(receipt)
-        receipt_dict['items'] = json.loads(receipt_dict['items'])
-        receipt_dict['total'] = receipt_dict.pop('total_amount', 0)
-        receipt_dict['change'] = receipt_dict.pop('change_amount', 0)
-        receipt_dict['created_at'] = receipt_dict.pop('timestamp', '')
-        receipts_list.append(receipt_dict)
+        for item in receipt['items'] or [{}]:
+            line = dict(receipt)
+            for key in ('barcode', 'name', 'quantity', 'price', 'subtotal'):
+                line['item_' + key] = item.get(key)
+            yield line
+
+@receipts_bp.route('/receipts/export', methods=['GET'])
+def export_receipts():
+    """Stream receipts with their items, oldest first, as NDJSON or CSV
+
+    Query parameters: ``format`` (ndjson or csv), ``compress=gzip``,
+    ``start``/``end`` dates and ``payment_method``. Archived receipts in
+    the range are exported too.
+    """
+    try:
+        fmt, compress = parse_export_format(request.args)
+        where, params = date_range_filters(request.args, 'r.timestamp')
+        partitions = partitions_for(get_db_connection(), request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get('payment_method'):
+        where.append("r.payment_method = ?")
+        params.append(request.args['payment_method'])
     
-    return jsonify(receipts_list)
+    columns = ', '.join('r.' + column.strip() for column in RECEIPT_COLUMNS.split(','))
+    # Archived years one at a time, oldest first, then the live tables; each
+    # joins its own items by their receipt_id index
+    segments = []
+    for partition in partitions + [None]:
+        query = f"""
+            SELECT {columns}, ri.barcode AS item_barcode, ri.name AS item_name, ri.quantity AS item_quantity,
+                   ri.unit_price AS item_unit_price, ri.subtotal AS item_subtotal
+            FROM {partition_table('receipts', partition, 'r')}
+            LEFT JOIN {partition_table('receipt_items', partition, 'ri')} ON ri.receipt_id = r.receipt_id
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY r.timestamp, r.id, ri.id
+        """
+        segments.append((query, params, [partition] if partition else []))
+    
+    records = _export_receipts(iter_segments(segments))
+    if fmt == 'csv':
+        records = _flatten_receipt_lines(records)
+    return export_response(records, RECEIPT_EXPORT_COLUMNS, fmt, compress, 'receipts')
+
+def _fetch_receipt_rows(conn, receipt_id, partition=None):
+    # The live tables, or one attached archive partition
+    return conn.execute(
+        f"""
+        SELECT r.*, ri.barcode AS item_barcode, ri.name AS item_name, ri.quantity AS item_quantity,
+               ri.unit_price AS item_unit_price, ri.subtotal AS item_subtotal
+        FROM (SELECT {RECEIPT_COLUMNS} FROM {partition_table('receipts', partition)} WHERE receipt_id = ?) r
+        LEFT JOIN {partition_table('receipt_items', partition, 'ri')} ON ri.receipt_id = r.receipt_id
+        ORDER BY ri.id
+        """,
+        (receipt_id,)
+    ).fetchall()
 
 @receipts_bp.route('/receipts/<receipt_id>', methods=['GET'])
 def get_receipt(receipt_id):
-    """Get a specific receipt by ID"""
+    """Get a specific receipt by ID, live or archived"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM receipts WHERE receipt_id = ?", (receipt_id,))
-    receipt = cursor.fetchone()
-    conn.close()
+    rows = _fetch_receipt_rows(conn, receipt_id)
+    if not rows:
+        partition = find_receipt_partition(conn, receipt_id)
+        if partition:
+            with attached(conn, [partition]):
+                rows = _fetch_receipt_rows(conn, receipt_id, partition)
     
-    if receipt:
-        receipt_dict = dict(receipt)
-        receipt_dict['items'] = json.loads(receipt_dict['items'])
-        receipt_dict['total'] = receipt_dict.pop('total_amount', 0)
-        receipt_dict['change'] = receipt_dict.pop('change_amount', 0)
-        receipt_dict['created_at'] = receipt_dict.pop('timestamp', '')
-        return jsonify(receipt_dict)
+    if rows:
+        items = [
+            {
+                "barcode": row['item_barcode'],
+                "name": row['item_name'],
+                "quantity": row['item_quantity'],
+                "price": row['item_unit_price'],
+                "subtotal": row['item_subtotal']
+            }
+            for row in rows if row['item_name'] is not None
+        ]
+        receipt = {key: rows[0][key] for key in rows[0].keys() if not key.startswith('item_')}
+        return jsonify(_receipt_dict(receipt, items))
     else:
         return jsonify({"error": "Receipt not found"}), 404
 
 @receipts_bp.route('/receipts/<receipt_id>', methods=['DELETE'])
 def delete_receipt(receipt_id):
-    """Delete a receipt"""
+    """Delete a receipt, live or archived"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -100,12 +272,13 @@ def delete_receipt(receipt_id):
     cursor.execute("SELECT * FROM receipts WHERE receipt_id = ?", (receipt_id,))
     receipt = cursor.fetchone()
     if not receipt:
-        conn.close()
+        if delete_archived_receipt(conn, receipt_id):
+            return jsonify({"message": "Receipt deleted successfully"})
         return jsonify({"error": "Receipt not found"}), 404
     
-    # Delete receipt
+    # Delete receipt and its items
+    cursor.execute("DELETE FROM receipt_items WHERE receipt_id = ?", (receipt_id,))
     cursor.execute("DELETE FROM receipts WHERE receipt_id = ?", (receipt_id,))
     conn.commit()
-    conn.close()
     
     return jsonify({"message": "Receipt deleted successfully"})
\ No newline at end of file
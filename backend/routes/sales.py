@@ -4,17 +4,44 @@ Sales API routes
 
 from flask import Blueprint, request, jsonify
 from database import get_db_connection
+from catalog_cache import product_cache
+from sale_queue import get_sale_queue, WRITE_BEHIND_ENABLED
+from datetime import datetime
+import math
+from pagination import fetch_page, date_range_filters, NEXT_CURSOR_HEADER
+from export import iter_segments, export_response, parse_export_format
+from archive import attached, history_table, listing_partitions, partition_table, partitions_for
 
 sales_bp = Blueprint('sales', __name__)
 
 @sales_bp.route('/sales', methods=['POST'])
 def record_sale():
-    """Record a sale transaction"""
+    """Record a sale transaction
+
+    In write-behind mode (BILLING_SALES_WRITE_BEHIND=1) the sale is journaled
+    and acknowledged with 202, and stored with the next batch.
+    """
     data = request.get_json()
     
     if not all(key in data for key in ['barcode', 'name', 'price']):
         return jsonify({"error": "Missing required fields"}), 400
     
+    if WRITE_BEHIND_ENABLED:
+        # Checked up front: a sale the database would refuse can't be turned
+        # down once it has been acknowledged
+        if not all(isinstance(data[key], str) and data[key].strip() for key in ['barcode', 'name']):
+            return jsonify({"error": "barcode and name must be non-empty strings"}), 400
+        if (isinstance(data['price'], bool) or not isinstance(data['price'], (int, float))
+                or not math.isfinite(data['price'])):
+            return jsonify({"error": "Invalid price"}), 400
+        queue = get_sale_queue()
+        try:
+            sale = queue.enqueue(data['barcode'], data['name'], float(data['price']))
+        except OSError as e:
+            return jsonify({"error": f"Could not journal sale: {e}"}), 503
+        # Durable in the journal; written to the database with the next batch
+        return jsonify({"message": "Sale queued", "timestamp": sale['timestamp']}), 202
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -32,71 +59,159 @@ def record_sale():
         )
         
         conn.commit()
-        conn.close()
+        product_cache.invalidate(data['barcode'])
         
         return jsonify({"message": "Sale recorded successfully"}), 201
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@sales_bp.route('/sales/queue', methods=['GET'])
+def get_sale_queue_stats():
+    """Get write-behind sale queue statistics for this process and store"""
+    return jsonify(get_sale_queue().stats())
+
 @sales_bp.route('/sales', methods=['GET'])
 def get_sales():
-    """Get all sales records"""
+    """Get sales records, newest first, one page at a time
+
+    Query parameters: ``limit``, ``cursor`` (from the X-Next-Cursor header
+    of the previous page), ``start``/``end`` dates and ``barcode``. Archived
+    sales in the range are read too.
+    """
+    where, params = [], []
+    if request.args.get('barcode'):
+        where.append("barcode = ?")
+        params.append(request.args['barcode'])
+    
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM sales ORDER BY timestamp DESC")
-    sales = cursor.fetchall()
-    conn.close()
+    try:
+        partitions, resume_cursor = listing_partitions(conn, request.args)
+        with attached(conn, partitions):
+            sales, next_cursor = fetch_page(conn, f"SELECT * FROM {history_table('sales', partitions)}",
+                                            where, params, request.args)
+        next_cursor = next_cursor or resume_cursor
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    return jsonify([dict(sale) for sale in sales])
+    response = jsonify([dict(sale) for sale in sales])
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
 
-@sales_bp.route('/forecast', methods=['GET'])
-def run_forecast():
-    """Run stock forecasting analysis"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+SALES_EXPORT_COLUMNS = ['id', 'barcode', 'name', 'price', 'timestamp']
+
+@sales_bp.route('/sales/export', methods=['GET'])
+def export_sales():
+    """Stream sales records, oldest first, as NDJSON or CSV
+
+    Query parameters: ``format`` (ndjson or csv), ``compress=gzip``,
+    ``start``/``end`` dates and ``barcode``. Archived sales in the range
+    are exported too.
+    """
+    try:
+        fmt, compress = parse_export_format(request.args)
+        where, params = date_range_filters(request.args)
+        partitions = partitions_for(get_db_connection(), request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get('barcode'):
+        where.append("barcode = ?")
+        params.append(request.args['barcode'])
+    
+    # Archived years one at a time, oldest first, then the live table
+    segments = []
+    for partition in partitions + [None]:
+        query = f"SELECT {', '.join(SALES_EXPORT_COLUMNS)} FROM {partition_table('sales', partition)}"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY timestamp, id"
+        segments.append((query, params, [partition] if partition else []))
     
-    # Get sales count by product
-    cursor.execute("""
-        SELECT barcode, name, COUNT(*) as sales_count 
-        FROM sales 
-        GROUP BY barcode 
-        ORDER BY sales_count DESC
-    """)
+    records = (dict(row) for row in iter_segments(segments))
+    return export_response(records, SALES_EXPORT_COLUMNS, fmt, compress, 'sales')
+
+@sales_bp.route('/sales/summary', methods=['GET'])
+def get_sales_summary():
+    """Get units sold and revenue per product from the daily rollup
+
+    Query parameters: ``start``/``end`` dates (inclusive), ``barcode``, and
+    ``group=day`` for one row per product per day instead of per product.
+    """
+    where, params = [], []
+    try:
+        for key, op in (('start', '>='), ('end', '<=')):
+            if request.args.get(key):
+                where.append(f"day {op} ?")
+                params.append(datetime.strptime(request.args[key], '%Y-%m-%d').date().isoformat())
+    except ValueError:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates"}), 400
+    if request.args.get('barcode'):
+        where.append("sd.barcode = ?")
+        params.append(request.args['barcode'])
     
-    sales_data = cursor.fetchall()
+    by_day = request.args.get('group') == 'day'
+    query = f"""
+        SELECT sd.barcode, p.name, {'sd.day,' if by_day else ''}
+               SUM(sd.units) AS units, SUM(sd.revenue) AS revenue
+        FROM sales_daily sd
+        LEFT JOIN products p ON p.barcode = sd.barcode
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        GROUP BY sd.barcode{', sd.day' if by_day else ''}
+        ORDER BY {'sd.day DESC, ' if by_day else ''}units DESC
+    """
     
-    if not sales_data:
-        conn.close()
-        return jsonify({"message": "No sales data available for analysis"})
+    conn = get_db_connection()
+    rows = conn.execute(query, params).fetchall()
+    return jsonify([dict(row) for row in rows])
+
+@sales_bp.route('/forecast', methods=['GET'])
+def run_forecast():
+    """Run stock forecasting analysis for every product
+
+    Query parameters: ``history_days`` (default 365) and ``lead_time``
+    (days until a reorder arrives, default 7). The top seller summary of
+    the original endpoint is kept alongside the per-product forecasts.
+    """
+    import forecasting  # NumPy is only loaded once a forecast is requested
     
-    # Get top selling product
-    top_seller = dict(sales_data[0])
+    try:
+        history_days = min(int(request.args.get('history_days', forecasting.HISTORY_DAYS)), forecasting.MAX_HISTORY_DAYS)
+        lead_time = int(request.args.get('lead_time', forecasting.LEAD_TIME_DAYS))
+        if history_days <= 0 or lead_time < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "history_days must be positive and lead_time non-negative"}), 400
     
-    # Get current stock for top seller
-    cursor.execute("SELECT stock FROM products WHERE barcode = ?", (top_seller['barcode'],))
-    stock_result = cursor.fetchone()
-    current_stock = stock_result['stock'] if stock_result else 0
+    conn = get_db_connection()
+    forecasts = forecasting.run(conn, history_days=history_days, lead_time=lead_time)
     
-    conn.close()
+    if not any(f['units_sold'] for f in forecasts):
+        return jsonify({"message": "No sales data available for analysis"})
     
-    # Forecasting logic
-    LOW_STOCK_THRESHOLD = 15
+    top_seller = max(forecasts, key=lambda f: f['units_sold'])
+    alerts = [f for f in forecasts if f['alert']]
     
     forecast_result = {
         "top_seller": {
             "barcode": top_seller['barcode'],
             "name": top_seller['name'],
-            "sales_count": top_seller['sales_count'],
-            "current_stock": current_stock
+            "sales_count": top_seller['units_sold'],
+            "current_stock": top_seller['current_stock']
         },
-        "alert": current_stock < LOW_STOCK_THRESHOLD,
-        "message": f"High demand detected for '{top_seller['name']}' with {top_seller['sales_count']} units sold. "
-                   f"Current stock: {current_stock} units."
+        "alert": bool(alerts),
+        "message": f"High demand detected for '{top_seller['name']}' with {top_seller['units_sold']} units sold. "
+                   f"Current stock: {top_seller['current_stock']} units. "
+                   f"{len(alerts)} product(s) expected to run out within {lead_time} days.",
+        "history_days": history_days,
+        "lead_time_days": lead_time,
+        "products": forecasts
     }
     
     if forecast_result['alert']:
-        forecast_result["recommendation"] = "Restock this item immediately"
+        forecast_result["recommendation"] = "Restock: " + ", ".join(
+            f"{f['name']} ({f['reorder_quantity']} units)" for f in alerts[:5]
+        )
     else:
         forecast_result["recommendation"] = "Stock levels appear adequate"
     
@@ -0,0 +1,95 @@
+"""
+Head-office API routes that aggregate across every store's database
+"""
+
+from flask import Blueprint, request, jsonify
+from database import fan_out, store_ids
+from datetime import datetime
+
+stores_bp = Blueprint('stores', __name__)
+
+LOW_STOCK_THRESHOLD = 10
+
+def day_filters(args):
+    """WHERE clauses and params on sales_daily.day for ``start``/``end`` dates"""
+    where, params = [], []
+    for key, op in (('start', '>='), ('end', '<=')):
+        if args.get(key):
+            where.append(f"day {op} ?")
+            params.append(datetime.strptime(args[key], '%Y-%m-%d').date().isoformat())
+    return where, params
+
+@stores_bp.route('/stores', methods=['GET'])
+def list_stores():
+    """Get the ids of the stores this server serves"""
+    return jsonify(store_ids())
+
+@stores_bp.route('/stores/summary', methods=['GET'])
+def get_stores_summary():
+    """Get units, revenue and stock health per store, plus chain-wide totals
+
+    Query parameters: ``start``/``end`` dates (inclusive).
+    """
+    try:
+        where, params = day_filters(request.args)
+    except ValueError:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates"}), 400
+
+    def summarize(conn, store):
+        sales = conn.execute(f"""
+            SELECT COALESCE(SUM(units), 0) AS units, COALESCE(SUM(revenue), 0) AS revenue
+            FROM sales_daily {'WHERE ' + ' AND '.join(where) if where else ''}
+        """, params).fetchone()
+        stock = conn.execute(
+            "SELECT COUNT(*) AS products, COALESCE(SUM(stock < ?), 0) AS low_stock FROM products",
+            (LOW_STOCK_THRESHOLD,)
+        ).fetchone()
+        return {**dict(sales), **dict(stock)}
+
+    stores = fan_out(summarize)
+    totals = {key: sum(store[key] for store in stores.values()) for key in ('units', 'revenue', 'low_stock')}
+    return jsonify({"stores": stores, "totals": totals})
+
+@stores_bp.route('/stores/top-products', methods=['GET'])
+def get_top_products():
+    """Get the best-selling products across all stores
+
+    Query parameters: ``start``/``end`` dates (inclusive) and ``limit``
+    (default 20).
+    """
+    try:
+        where, params = day_filters(request.args)
+        limit = max(1, min(int(request.args.get('limit', 20)), 500))
+    except ValueError:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates and limit an integer"}), 400
+
+    def product_sales(conn, store):
+        return conn.execute(f"""
+            SELECT sd.barcode, p.name, SUM(sd.units) AS units, SUM(sd.revenue) AS revenue
+            FROM sales_daily sd
+            LEFT JOIN products p ON p.barcode = sd.barcode
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            GROUP BY sd.barcode
+        """, params).fetchall()
+
+    merged = {}
+    for store, rows in fan_out(product_sales).items():
+        for row in rows:
+            product = merged.setdefault(row['barcode'], {"barcode": row['barcode'], "name": row['name'],
+                                                         "units": 0, "revenue": 0.0, "stores": {}})
+            product['name'] = product['name'] or row['name']
+            product['units'] += row['units']
+            product['revenue'] += row['revenue']
+            product['stores'][store] = row['units']
+
+    top = sorted(merged.values(), key=lambda product: product['units'], reverse=True)[:limit]
+    return jsonify(top)
+
+@stores_bp.route('/stores/stock/<barcode>', methods=['GET'])
+def get_stock_by_store(barcode):
+    """Get a product's stock level in every store"""
+    def stock(conn, store):
+        row = conn.execute("SELECT name, price, stock FROM products WHERE barcode = ?", (barcode,)).fetchone()
+        return dict(row) if row else None
+
+    return jsonify({"barcode": barcode, "stores": fan_out(stock)})
@@ -0,0 +1,381 @@
+"""
+Group-commit write-behind queue for recording sales
+
+With BILLING_SALES_WRITE_BEHIND=1, POST /api/sales acknowledges a sale once
+it is appended to an fsynced journal instead of committing it to SQLite.
+Concurrent requests share one journal fsync, and a background writer
+applies queued sales in batches (every SALES_FLUSH_MS or SALES_FLUSH_ROWS
+sales, whichever comes first) with their stock decrements in the same
+transaction, so throughput scales with batch size rather than fsync rate.
+
+Each server process writes its own journal file per store and holds a lock
+on it while it lives. The journal position applied to the database is
+committed with every batch, so on the next startup recover_journals()
+replays exactly the sales a crash (of the server or of a single worker)
+left unapplied, skipping the still-locked journals of live workers. Sales
+the database refuses outright are set aside in a rejected-sales file
+instead of blocking the batches behind them.
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows, which is only served by a single waitress process
+    fcntl = None
+
+import database
+from catalog_cache import product_cache
+
+WRITE_BEHIND_ENABLED = os.environ.get('BILLING_SALES_WRITE_BEHIND', '0') == '1'
+# A batch is flushed when its oldest sale has waited this long...
+SALES_FLUSH_MS = float(os.environ.get('BILLING_SALES_FLUSH_MS', 50))
+# ...or once this many sales are queued
+SALES_FLUSH_ROWS = int(os.environ.get('BILLING_SALES_FLUSH_ROWS', 500))
+# Seconds to wait before retrying a batch the database refused (e.g. locked)
+RETRY_DELAY = 1.0
+
+JOURNAL_SUFFIX = '.journal'
+# Sales the database refused, next to the journals (recovery ignores it)
+REJECTED_FILE = 'rejected-sales.jsonl'
+
+logger = logging.getLogger('billing.sale_queue')
+
+def journal_dir(store=database.DEFAULT_STORE):
+    """Directory holding a store's journals, next to its database file"""
+    base = os.environ.get('BILLING_SALES_JOURNAL_DIR')
+    if base:
+        return base if store == database.DEFAULT_STORE else os.path.join(base, store)
+    path = database.db_path(store)
+    return str(path.parent / ('sales-journal' if store == database.DEFAULT_STORE else f'{store}-sales-journal'))
+
+def _lock_journal(f, blocking=True):
+    """Take an exclusive lock on an open journal; False if another process holds it"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        return True
+    except BlockingIOError:
+        return False
+
+def _open_journal(path):
+    """Create and lock a new journal
+
+    The file is locked before it gets its journal name, so recover_journals()
+    in another process never takes a journal just being created for one
+    left behind by a dead process.
+    """
+    if fcntl is None:
+        return open(path, 'ab')
+    f = open(path + '.new', 'ab')
+    _lock_journal(f)
+    os.rename(path + '.new', path)
+    return f
+
+def _is_current(f, path):
+    """Whether path still names the open file f (not removed or replaced since)"""
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+def _write_sales(conn, journal, sales, one_by_one=False):
+    # Stores sales in one transaction; one_by_one leaves out (and returns)
+    # those the database refuses instead of failing the whole batch
+    stored, rejected = sales, []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        insert = "INSERT INTO sales (barcode, name, price, timestamp) VALUES (?, ?, ?, ?)"
+        if one_by_one:
+            stored = []
+            for sale in sales:
+                try:
+                    conn.execute(insert, (sale['barcode'], sale['name'], sale['price'], sale['timestamp']))
+                    stored.append(sale)
+                except sqlite3.IntegrityError:
+                    rejected.append(sale)
+        else:
+            conn.executemany(insert, [(sale['barcode'], sale['name'], sale['price'], sale['timestamp'])
+                                      for sale in sales])
+
+        units = {}
+        for sale in stored:
+            units[sale['barcode']] = units.get(sale['barcode'], 0) + 1
+        conn.executemany(
+            "UPDATE products SET stock = MAX(stock - ?, 0) WHERE barcode = ?",
+            [(count, barcode) for barcode, count in units.items()]
+        )
+        conn.execute(
+            "INSERT INTO sale_journal_state (journal, applied_seq) VALUES (?, ?) "
+            "ON CONFLICT (journal) DO UPDATE SET applied_seq = excluded.applied_seq",
+            (journal, sales[-1]['seq'])
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return list(units), rejected
+
+def apply_sales(conn, journal, sales):
+    """Insert sales, decrement stock and record the journal position, in one transaction
+
+    Each sale is one unit, as with a direct POST /api/sales; stock is
+    decremented per barcode and never goes below zero. Sales the database
+    refuses outright (IntegrityError, e.g. journaled before they were
+    validated) are left out rather than holding up the rest; returns the
+    barcodes sold and the sales left out. The commit is fsynced
+    (synchronous=FULL) even though pooled connections run with NORMAL,
+    because the journal it supersedes may be truncated right after.
+    """
+    conn.execute("PRAGMA synchronous = FULL")
+    try:
+        try:
+            return _write_sales(conn, journal, sales)
+        except sqlite3.IntegrityError:
+            return _write_sales(conn, journal, sales, one_by_one=True)
+    finally:
+        conn.execute(f"PRAGMA synchronous = {database.CONNECTION_PRAGMAS['synchronous']}")
+
+def set_aside(store, journal, sales):
+    """Append sales the database refused to the store's rejected-sales file, for manual review
+
+    They are already past in the journal position, so this is the only
+    record of them left.
+    """
+    path = os.path.join(journal_dir(store), REJECTED_FILE)
+    lines = [json.dumps(dict(sale, journal=journal), separators=(',', ':')) for sale in sales]
+    try:
+        with open(path, 'ab') as f:
+            f.write(''.join(line + '\n' for line in lines).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+    except OSError as e:
+        # Never stop the writer over this; the log is the record then
+        logger.error("Could not write %s (%s); refused sales: %s", path, e, ' '.join(lines))
+        return
+    logger.warning("Set aside %d sale(s) from %s the database refused; see %s", len(sales), journal, path)
+
+def read_journal(path, after_seq=0):
+    """Sales in a journal file with a sequence number above after_seq
+
+    A torn last line (the process died mid-write, before acknowledging it) is skipped.
+    """
+    sales = []
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                sale = json.loads(line)
+            except ValueError:
+                continue
+            if sale['seq'] > after_seq:
+                sales.append(sale)
+    return sales
+
+def recover_journals(store=database.DEFAULT_STORE):
+    """Apply whatever a store's journals left behind by dead processes hold, then remove them
+
+    Journals still locked by a live process (e.g. a sibling worker, when a
+    worker is respawned or the app is imported by every worker) are left
+    alone. Returns the number of sales replayed.
+    """
+    directory = journal_dir(store)
+    if not os.path.isdir(directory):
+        return 0
+
+    replayed = 0
+    store_pool = database.get_pool(store)
+    conn = store_pool.acquire()
+    try:
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(JOURNAL_SUFFIX):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue  # recovered by another process meanwhile
+            with f:
+                # Held by a live process, or recovered and removed while we waited
+                if not _lock_journal(f, blocking=False) or not _is_current(f, path):
+                    continue
+                row = conn.execute("SELECT applied_seq FROM sale_journal_state WHERE journal = ?", (name,)).fetchone()
+                sales = read_journal(path, row['applied_seq'] if row else 0)
+                if sales:
+                    barcodes, rejected = apply_sales(conn, name, sales)
+                    if rejected:
+                        set_aside(store, name, rejected)
+                    product_cache.invalidate(*barcodes, store=store)
+                    replayed += len(sales) - len(rejected)
+                # Forget the position only once the file is gone, so a crash in
+                # between can't replay the journal from the start
+                os.remove(path)
+                conn.execute("DELETE FROM sale_journal_state WHERE journal = ?", (name,))
+                conn.commit()
+    finally:
+        store_pool.release(conn)
+    return replayed
+
+class SaleWriteQueue:
+    """Journal plus in-memory queue of a store's sales awaiting a batched database write"""
+
+    def __init__(self, store=database.DEFAULT_STORE, flush_ms=SALES_FLUSH_MS, flush_rows=SALES_FLUSH_ROWS):
+        self.store = store
+        self.flush_interval = flush_ms / 1000
+        self.flush_rows = flush_rows
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def _start(self):
+        # Started lazily, and again after a fork, so each server process has
+        # its own journal file and writer thread
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            directory = journal_dir(self.store)
+            os.makedirs(directory, exist_ok=True)
+            self.journal = f"sales-{os.getpid()}-{uuid.uuid4().hex[:8]}{JOURNAL_SUFFIX}"
+            self._file = _open_journal(os.path.join(directory, self.journal))
+            self._write_lock = threading.Lock()
+            self._sync_lock = threading.Lock()
+            self._written_seq = 0
+            self._synced_seq = 0
+            self._applied_seq = 0
+            self._pending = []
+            self._cond = threading.Condition()
+            self._stopping = False
+            self._writer = threading.Thread(target=self._run, name='sale-writer', daemon=True)
+            self._writer.start()
+            self._pid = os.getpid()
+
+    def enqueue(self, barcode, name, price):
+        """Durably queue one unit sold; returns once the sale is in the fsynced journal"""
+        self._start()
+        sale = {
+            "barcode": barcode,
+            "name": name,
+            "price": price,
+            # Same format and clock (UTC) as the sales.timestamp default
+            "timestamp": datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self._write_lock:
+            self._written_seq += 1
+            sale['seq'] = seq = self._written_seq
+            self._file.write(json.dumps(sale, separators=(',', ':')).encode('utf-8') + b'\n')
+            # Queued under the write lock so batches are always in journal order
+            with self._cond:
+                self._pending.append(sale)
+                # Wake the writer to start a batch's clock, or to flush a full one
+                if len(self._pending) == 1 or len(self._pending) >= self.flush_rows:
+                    self._cond.notify()
+        self._sync(seq)
+        return sale
+
+    def _sync(self, seq):
+        # Group commit: whoever gets the lock fsyncs everything written so
+        # far, and requests that queued behind it find their sale already synced
+        with self._sync_lock:
+            if self._synced_seq >= seq:
+                return
+            with self._write_lock:
+                self._file.flush()
+                upto = self._written_seq
+            os.fsync(self._file.fileno())
+            self._synced_seq = upto
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            if not self._stopping and len(self._pending) < self.flush_rows:
+                self._cond.wait(self.flush_interval)
+            batch, self._pending = self._pending, []
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return  # stopping and drained
+            self._flush(batch)
+
+    def _flush(self, batch):
+        while True:
+            store_pool = database.get_pool(self.store)
+            conn = store_pool.acquire()
+            try:
+                barcodes, rejected = apply_sales(conn, self.journal, batch)
+                break
+            except sqlite3.Error:
+                self.failures += 1
+                time.sleep(RETRY_DELAY)
+            finally:
+                store_pool.release(conn)
+
+        if rejected:
+            set_aside(self.store, self.journal, rejected)
+            self.rejected += len(rejected)
+        product_cache.invalidate(*barcodes, store=self.store)
+        self.flushed += len(batch) - len(rejected)
+        self.batches += 1
+        self._applied_seq = batch[-1]['seq']
+
+        # Once everything written has been applied the journal can start over
+        with self._write_lock:
+            if self._written_seq == self._applied_seq:
+                self._file.flush()
+                self._file.truncate(0)
+
+    def stop(self):
+        """Flush queued sales and stop the writer"""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._writer.join()
+
+    def stats(self):
+        pending = len(self._pending) if self._pid == os.getpid() else 0
+        return {
+            "enabled": WRITE_BEHIND_ENABLED,
+            "store": self.store,
+            "pending": pending,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "flush_ms": self.flush_interval * 1000,
+            "flush_rows": self.flush_rows,
+        }
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def get_sale_queue(store=None):
+    """The write-behind queue of a store, by default the current request's"""
+    store = store or database.current_store()
+    try:
+        return _queues[store]
+    except KeyError:
+        with _queues_lock:
+            return _queues.setdefault(store, SaleWriteQueue(store))
+
+@atexit.register
+def _stop_all():
+    for queue in list(_queues.values()):
+        queue.stop()
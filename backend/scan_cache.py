@@ -0,0 +1,92 @@
+"""
+Per-session suppression of duplicate camera frames and repeated scans
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a decode result is reused for near-identical frames of a session
+FRAME_CACHE_TTL = float(os.environ.get('BILLING_SCAN_FRAME_TTL', 2.0))
+# Frames whose perceptual hashes differ in at most this many of 64 bits count as the same
+FRAME_HASH_DISTANCE = int(os.environ.get('BILLING_SCAN_HASH_DISTANCE', 4))
+# Seconds during which the same barcode scanned again in a session is flagged as a repeat
+SCAN_DEBOUNCE = float(os.environ.get('BILLING_SCAN_DEBOUNCE', 1.5))
+# Recent frames remembered per session and sessions remembered overall
+FRAMES_PER_SESSION = 16
+MAX_SESSIONS = 256
+
+class _Session:
+    def __init__(self):
+        self.frames = []  # [(expires_at, options, frame_hash, result)], newest last
+        self.last_barcode = None
+        self.last_barcode_at = 0.0
+
+class ScanSessionCache:
+    """Remembers recent frames and barcodes per scanning session"""
+
+    def __init__(self, ttl=FRAME_CACHE_TTL, distance=FRAME_HASH_DISTANCE, debounce=SCAN_DEBOUNCE):
+        self.ttl = ttl
+        self.distance = distance
+        self.debounce = debounce
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def lookup(self, session_id, options, frame_hash):
+        """Return the decode result of a recent near-identical frame, or None"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._session(session_id)
+            session.frames = [entry for entry in session.frames if entry[0] > now]
+            for _, entry_options, entry_hash, result in reversed(session.frames):
+                if entry_options == options and bin(entry_hash ^ frame_hash).count('1') <= self.distance:
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def store(self, session_id, options, frame_hash, result):
+        """Remember the decode result for a frame"""
+        with self._lock:
+            session = self._session(session_id)
+            session.frames.append((time.monotonic() + self.ttl, options, frame_hash, result))
+            del session.frames[:-FRAMES_PER_SESSION]
+
+    def is_repeat(self, session_id, barcode):
+        """Record a scanned barcode; True if it is the same as the last one within the debounce window"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._session(session_id)
+            repeat = session.last_barcode == barcode and now - session.last_barcode_at < self.debounce
+            session.last_barcode = barcode
+            session.last_barcode_at = now
+            return repeat
+
+    def stats(self):
+        """Frame cache hit/miss counters, sessions remembered and settings"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "ttl": self.ttl,
+                "hash_distance": self.distance,
+                "debounce": self.debounce,
+            }
+
+scan_cache = ScanSessionCache()
@@ -0,0 +1,139 @@
+"""
+Bounded process pool for barcode decoding, off the request threads
+
+The imaging stack (OpenCV, NumPy, pyzbar) lives in imaging.py and is only
+imported when the first frame is decoded, so instances that never scan
+don't pay for it. Set BILLING_SCANNING=0 to disable scanning entirely.
+"""
+
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Set BILLING_SCANNING=0 on back-office instances that never scan
+SCANNING_ENABLED = os.environ.get('BILLING_SCANNING', '1') != '0'
+
+# Decoder processes; 0 decodes inline on the request thread (useful for debugging)
+SCAN_WORKERS = int(os.environ.get('BILLING_SCAN_WORKERS', os.cpu_count() or 1))
+# Frames allowed to wait for a free decoder before new ones are refused
+SCAN_QUEUE_SIZE = int(os.environ.get('BILLING_SCAN_QUEUE_SIZE', SCAN_WORKERS * 2))
+# Seconds a request waits for its frame to be decoded
+SCAN_TIMEOUT = float(os.environ.get('BILLING_SCAN_TIMEOUT', 2.0))
+
+# Accepted downscale factors for a single decode pass
+SCALES = (1, 2, 4, 8)
+
+# Most frames accepted in a single batch scan request
+MAX_BATCH_FRAMES = 8
+
+class DecoderBusy(Exception):
+    """Raised when the decode queue is full and the frame should be dropped"""
+
+class DecodeTimeout(Exception):
+    """Raised when a frame was not decoded within SCAN_TIMEOUT"""
+
+def _load_imaging():
+    """Import the imaging stack in a decoder process ahead of the first frame"""
+    import imaging  # noqa: F401
+    return os.getpid()
+
+class DecoderPool:
+    """Process pool with a bounded number of in-flight frames"""
+
+    def __init__(self, workers=SCAN_WORKERS, queue_size=SCAN_QUEUE_SIZE, timeout=SCAN_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily, and again after a fork, so each server process owns its decoders
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def start(self):
+        """Spawn the decoder processes ahead of the first frame"""
+        if self.workers:
+            executor = self._get_executor()
+            for future in [executor.submit(_load_imaging) for _ in range(self.workers)]:
+                future.result()
+        else:
+            _load_imaging()
+
+    def run(self, func, *args):
+        """Run func(*args) on a decoder process
+
+        Raises DecoderBusy without waiting if the queue is full, and
+        DecodeTimeout if the result takes longer than the pool's timeout.
+        Exceptions raised by func are re-raised here.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise DecoderBusy()
+
+        if not self.workers:
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self._reset()
+            raise
+        # The slot is only freed once the frame is finished, even if the
+        # request gave up on it, so a backlog of slow frames still counts
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise DecodeTimeout()
+        except BrokenProcessPool:
+            # A decoder died (e.g. crashed in native code); start fresh next time
+            self._reset()
+            raise
+
+    def _reset(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def decode(self, image_bytes, scale=None, roi=None):
+        """Decode one frame; see imaging.decode_frame"""
+        from imaging import decode_frame
+        return self.run(decode_frame, image_bytes, scale, roi)
+
+    def frame_hash(self, image_bytes):
+        """Perceptual hash of one frame for the scan cache; see imaging.frame_hash
+
+        Run on the pool like a decode, so it shares the queue bound (and the
+        429 when full) rather than using CPU on the request thread.
+        """
+        from imaging import frame_hash
+        return self.run(frame_hash, image_bytes)
+
+    def decode_batch(self, frames, roi=None):
+        """Decode several frames as one unit of work; see imaging.decode_frames"""
+        from imaging import decode_frames
+        return self.run(decode_frames, frames, roi)
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+decoder_pool = DecoderPool()
+atexit.register(decoder_pool.shutdown)
@@ -0,0 +1,149 @@
+"""
+Product name search for manual lookups at the till
+
+Names are matched word by word against the products_fts index: every word
+of the query must match, the last one (still being typed) as a prefix, and
+results are ranked by bm25. If the words as typed match nothing, misspelt
+ones are swapped for indexed words one edit away (a wrong, missing, extra or
+swapped letter), found through a deletion index over the FTS vocabulary.
+All-digit queries also match barcode prefixes.
+"""
+
+import re
+import threading
+import time
+
+from database import current_store, fts5_available
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Words shorter than this are only matched as prefixes, never corrected
+MIN_FUZZY_LENGTH = 4
+# Seconds a store's vocabulary index is reused. Exact and prefix matches are
+# always live; only corrections to words new to the catalog wait this long.
+VOCABULARY_TTL = 60
+
+WORD = re.compile(r'\w+')
+
+def words(text):
+    """Lowercased words of text, as the unicode61 tokenizer splits them"""
+    return WORD.findall(text.lower())
+
+def deletions(word):
+    """The word itself and every string one deleted letter shorter"""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+class Vocabulary:
+    """Deletion index over the indexed words of each store's products
+
+    Two words are within one edit exactly when their deletion sets
+    intersect, so a misspelt word is corrected with a handful of dict
+    lookups rather than a comparison against every word in the catalog.
+    """
+
+    def __init__(self, ttl=VOCABULARY_TTL):
+        self.ttl = ttl
+        self._indexes = {}  # store -> (expires_at, terms, deletion -> terms)
+        self._lock = threading.Lock()
+
+    def _index(self, conn, store):
+        now = time.monotonic()
+        entry = self._indexes.get(store)
+        if entry is None or entry[0] <= now:
+            terms = {row[0] for row in conn.execute("SELECT term FROM products_fts_vocab")}
+            by_deletion = {}
+            for term in terms:
+                if len(term) >= MIN_FUZZY_LENGTH - 1:
+                    for variant in deletions(term):
+                        by_deletion.setdefault(variant, set()).add(term)
+            entry = (now + self.ttl, terms, by_deletion)
+            with self._lock:
+                self._indexes[store] = entry
+        return entry[1], entry[2]
+
+    def corrections(self, conn, store, word):
+        """Indexed words one edit away from word, or [] if word is itself indexed"""
+        terms, by_deletion = self._index(conn, store)
+        if word in terms or len(word) < MIN_FUZZY_LENGTH:
+            return []
+        found = set()
+        for variant in deletions(word):
+            found |= by_deletion.get(variant, set())
+        return sorted(found)
+
+    def invalidate(self, store=None):
+        """Rebuild a store's index on its next use; call after product names change"""
+        with self._lock:
+            self._indexes.pop(store or current_store(), None)
+
+vocabulary = Vocabulary()
+
+def _quote(word):
+    return '"' + word.replace('"', '""') + '"'
+
+def _match_expression(query_words, alternatives=None):
+    """FTS5 MATCH expression requiring every word, the last as a prefix"""
+    parts = []
+    for i, word in enumerate(query_words):
+        options = [_quote(word) + ('*' if i == len(query_words) - 1 else '')]
+        options += [_quote(alternative) for alternative in (alternatives or {}).get(word, [])]
+        parts.append(options[0] if len(options) == 1 else '(' + ' OR '.join(options) + ')')
+    return ' AND '.join(parts)
+
+def _fts_search(conn, expression, limit, exclude=()):
+    rows = conn.execute('''
+        SELECT p.*
+        FROM products_fts
+        JOIN products p ON p.rowid = products_fts.rowid
+        WHERE products_fts MATCH ?
+        ORDER BY bm25(products_fts)
+        LIMIT ?
+    ''', (expression, limit + len(exclude))).fetchall()
+    return [dict(row) for row in rows if row['barcode'] not in exclude][:limit]
+
+def _barcode_prefix_search(conn, prefix, limit):
+    # A range on the primary key, so it's an index seek rather than a LIKE scan
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    rows = conn.execute(
+        "SELECT * FROM products WHERE barcode >= ? AND barcode < ? ORDER BY barcode LIMIT ?",
+        (prefix, upper, limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def _like_search(conn, query_words, limit):
+    """Fallback for SQLite builds without FTS5"""
+    rows = conn.execute(
+        f"SELECT * FROM products WHERE {' AND '.join(['name LIKE ?'] * len(query_words))} ORDER BY name LIMIT ?",
+        [f'%{word}%' for word in query_words] + [limit]
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def search_products(conn, query, limit=DEFAULT_LIMIT):
+    """Products matching query, best first, each with a ``match`` of
+    ``barcode``, ``prefix`` or ``fuzzy``"""
+    query = query.strip()
+    query_words = words(query)
+    results = []
+
+    if query.isdigit():
+        results = [dict(product, match='barcode') for product in _barcode_prefix_search(conn, query, limit)]
+    if not query_words or len(results) >= limit:
+        return results[:limit]
+
+    seen = {product['barcode'] for product in results}
+    if not fts5_available(conn):
+        return results + [dict(product, match='prefix')
+                          for product in _like_search(conn, query_words, limit - len(results))
+                          if product['barcode'] not in seen]
+
+    prefix_matches = _fts_search(conn, _match_expression(query_words), limit - len(results), seen)
+    results += [dict(product, match='prefix') for product in prefix_matches]
+
+    # Corrections are only tried when the words as typed match nothing
+    if not prefix_matches:
+        store = current_store()
+        alternatives = {word: vocabulary.corrections(conn, store, word) for word in query_words}
+        if any(alternatives.values()):
+            for product in _fts_search(conn, _match_expression(query_words, alternatives), limit - len(results), seen):
+                results.append(dict(product, match='fuzzy'))
+    return results
@@ -0,0 +1,104 @@
+"""
+Production server entry point
+
+    python serve.py --workers 4 --threads 8 --port 5000
+
+Runs migrations once in this (parent) process, preloads the app and warms
+the product cache before any worker starts, then serves with gunicorn
+(preforked workers, each with a thread pool and its own barcode decoder
+processes). Where gunicorn isn't available (Windows), falls back to a
+single waitress process with a thread pool.
+
+Every option can also be set with an environment variable, e.g.
+BILLING_WORKERS=4. Readiness is reported at /api/ready, liveness at /api/health.
+"""
+
+import argparse
+import os
+import time
+
+def parse_args():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Run the billing API with a production WSGI server")
+    parser.add_argument('--host', default=os.environ.get('BILLING_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('BILLING_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('BILLING_WORKERS', cpus)),
+                        help="worker processes (gunicorn only)")
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('BILLING_THREADS', 8)),
+                        help="request threads per worker")
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('BILLING_WORKER_TIMEOUT', 30)),
+                        help="seconds before an unresponsive worker is restarted (gunicorn only)")
+    return parser.parse_args()
+
+def load_app(workers):
+    """Import the app (which runs init_db) and warm shared state in this process"""
+    # Split the cores between web workers so their decoder pools don't oversubscribe
+    os.environ.setdefault('BILLING_SCAN_WORKERS', str(max(1, (os.cpu_count() or 1) // max(workers, 1))))
+
+    started = time.perf_counter()
+    from app import app
+    from catalog_cache import warm_product_cache
+    from database import close_all_pools, get_db_connection, store_ids
+    from routes import IMPORT_TIMINGS
+    from scanner import SCANNING_ENABLED
+
+    if SCANNING_ENABLED:
+        # Load the imaging stack once here so forked workers share its pages
+        import imaging  # noqa: F401
+
+    cached = 0
+    for store in store_ids():
+        conn = get_db_connection(store)
+        try:
+            cached += warm_product_cache(conn, store)
+        finally:
+            conn.close()
+    # SQLite connections must not cross a fork; workers open their own
+    close_all_pools()
+
+    print(f"App loaded in {time.perf_counter() - started:.2f}s, {cached} products cached", flush=True)
+    print("Blueprint import times (ms): " + ", ".join(f"{name} {ms}" for name, ms in IMPORT_TIMINGS.items()), flush=True)
+    return app
+
+def serve_gunicorn(app, args):
+    from gunicorn.app.base import BaseApplication
+    from scanner import decoder_pool, SCANNING_ENABLED
+
+    class BillingApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{args.host}:{args.port}")
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', args.timeout)
+            self.cfg.set('preload_app', True)
+            if SCANNING_ENABLED:
+                self.cfg.set('post_fork', lambda server, worker: decoder_pool.start())
+
+        def load(self):
+            return app
+
+    BillingApplication().run()
+
+def serve_waitress(app, args):
+    from waitress import serve
+    from scanner import decoder_pool, SCANNING_ENABLED
+
+    if args.workers > 1:
+        print("gunicorn is not available; serving from a single process", flush=True)
+    if SCANNING_ENABLED:
+        decoder_pool.start()
+    serve(app, host=args.host, port=args.port, threads=args.threads)
+
+def main():
+    args = parse_args()
+    app = load_app(args.workers)
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        serve_waitress(app, args)
+    else:
+        serve_gunicorn(app, args)
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ import { Label } from '@/components/ui/label';
 import { RadioGroup, RadioGroupItem } from '@/components/ui/radio-group';
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
 import { IndianRupee, CreditCard, Wallet, Landmark } from 'lucide-react';
-import { salesApi, receiptsApi } from '@/lib/api';
+import { checkoutApi } from '@/lib/api';
 import type { CartItem } from '@/lib/types';
 
 interface CheckoutForm {
@@ -50,15 +50,12 @@ export default function CheckoutPage() {
     setLoading(true);
     
     try {
-      // Create receipt
-      await receiptsApi.create({
+      // Record receipt, sales and stock changes in one request
+      await checkoutApi.create({
         items: cart.map(item => ({
-          name: item.name,
-          quantity: item.quantity,
-          price: item.price,
-          subtotal: item.price * item.quantity
+          barcode: item.barcode,
+          quantity: item.quantity
         })),
-        total: totalAmount,
         payment_method: formData.paymentMethod.toUpperCase(),
         payment_status: 'COMPLETED',
         customer_name: formData.customerName,
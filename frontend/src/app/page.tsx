@@ -1,6 +1,6 @@
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
 import { Input } from '@/components/ui/input';
@@ -10,11 +10,16 @@ import { Camera, Scan, ShoppingCart, CreditCard, IndianRupee, X } from 'lucide-r
 
 import { CameraScanner } from '@/components/camera-scanner';
 import { ThemeToggle } from '@/components/theme-toggle';
-import { productsApi, salesApi, receiptsApi } from '@/lib/api';
+import { productsApi, salesApi, receiptsApi, eventsApi } from '@/lib/api';
+import type { CatalogEvent } from '@/lib/api';
 import type { Product, CartItem, PaymentResult } from '@/lib/types';
 
 
 
+// Delta polling interval and stream retry delay for when the change stream is refused
+const CATALOG_POLL_MS = 10000;
+const STREAM_RETRY_MS = 60000;
+
 export default function BillingPage() {
   const [cart, setCart] = useState<CartItem[]>([]);
   const [products, setProducts] = useState<Product[]>([]);
@@ -22,17 +27,92 @@ export default function BillingPage() {
   const [isCameraOpen, setIsCameraOpen] = useState(false);
 
   const [loading, setLoading] = useState(false);
+  // Catalog version the product list is current to (null if the backend doesn't report one)
+  const catalogVersion = useRef<number | null>(null);
 
-  // Load products from backend
+  // Load products from backend, then keep them current from the change stream,
+  // starting right after the loaded version so no change in between is missed.
+  // If the stream is refused, poll for deltas and try the stream again later.
   useEffect(() => {
-    fetchProducts();
+    let stopped = false;
+    let unsubscribe: (() => void) | null = null;
+    let pollTimer: ReturnType<typeof setInterval> | null = null;
+    let retryTimer: ReturnType<typeof setTimeout> | null = null;
+
+    const stopPolling = () => {
+      if (pollTimer) clearInterval(pollTimer);
+      pollTimer = null;
+    };
+    const subscribe = () => {
+      if (stopped) return;
+      unsubscribe = eventsApi.subscribe(applyCatalogEvent, catalogVersion.current ?? undefined, {
+        onOpen: stopPolling,
+        onClosed: () => {
+          if (!pollTimer) pollTimer = setInterval(pollCatalogChanges, CATALOG_POLL_MS);
+          retryTimer = setTimeout(subscribe, STREAM_RETRY_MS);
+        },
+      });
+    };
+
+    fetchProducts().then(subscribe);
+    return () => {
+      stopped = true;
+      unsubscribe?.();
+      stopPolling();
+      if (retryTimer) clearTimeout(retryTimer);
+    };
   }, []);
 
+  const pollCatalogChanges = async () => {
+    if (catalogVersion.current === null) {
+      await fetchProducts();
+      return;
+    }
+    try {
+      const { version, changed, deleted } = await productsApi.getChanges(catalogVersion.current);
+      setProducts(prevProducts => {
+        const removed = new Set(deleted);
+        const updates = new Map(changed.map(product => [product.barcode, product]));
+        const known = new Set(prevProducts.map(product => product.barcode));
+        return [
+          ...prevProducts
+            .filter(product => !removed.has(product.barcode))
+            .map(product => ({ ...product, ...updates.get(product.barcode) })),
+          ...changed.filter(product => !known.has(product.barcode)) as Product[],
+        ];
+      });
+      catalogVersion.current = version;
+    } catch (error) {
+      // 410: too far behind the change log; anything else is retried on the next poll
+      if ((error as { status?: number }).status === 410) await fetchProducts();
+    }
+  };
+
+  const applyCatalogEvent = (event: CatalogEvent) => {
+    if (event.type === 'catalog.reset') {
+      fetchProducts();
+      return;
+    }
+    catalogVersion.current = Math.max(catalogVersion.current ?? 0, event.seq);
+    setProducts(prevProducts => {
+      const others = prevProducts.filter(product => product.barcode !== event.barcode);
+      if (event.type === 'product.deleted' || !event.product) {
+        return others;
+      }
+      const existing = prevProducts.find(product => product.barcode === event.barcode);
+      const updated = { ...existing, ...event.product } as Product;
+      return existing
+        ? prevProducts.map(product => (product.barcode === event.barcode ? updated : product))
+        : [...others, updated];
+    });
+  };
+
   const fetchProducts = async () => {
     setLoading(true);
     try {
-      const data = await productsApi.getAll();
+      const { products: data, version } = await productsApi.getAllWithVersion();
       setProducts(data);
+      catalogVersion.current = version;
     } catch (error) {
       console.error('Error fetching products:', error);
       // Fallback to mock data if API fails
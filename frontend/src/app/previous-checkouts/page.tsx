@@ -12,6 +12,9 @@ import type { ReceiptI } from '@/lib/types';
 export default function PreviousCheckoutsPage() {
   const [receipts, setReceipts] = useState<ReceiptI[]>([]);
   const [loading, setLoading] = useState(true);
+  // Cursor for the next (older) page of receipts; null once everything is loaded
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchReceipts();
@@ -19,8 +22,9 @@ export default function PreviousCheckoutsPage() {
 
   const fetchReceipts = async () => {
     try {
-      const data = await receiptsApi.getAll();
-      setReceipts(data);
+      const page = await receiptsApi.getPage();
+      setReceipts(page.receipts);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       console.error('Error fetching receipts:', error);
     } finally {
@@ -28,6 +32,20 @@ export default function PreviousCheckoutsPage() {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const page = await receiptsApi.getPage(nextCursor);
+      setReceipts(prev => [...prev, ...page.receipts]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error fetching more receipts:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const formatDate = (dateString: string) => {
     return new Date(dateString).toLocaleDateString('en-IN', {
       year: 'numeric',
@@ -167,6 +185,13 @@ export default function PreviousCheckoutsPage() {
               </CardContent>
             </Card>
           ))}
+          {nextCursor && (
+            <div className="flex justify-center">
+              <Button onClick={loadMore} variant="outline" disabled={loadingMore}>
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </Button>
+            </div>
+          )}
         </div>
       )}
     </div>
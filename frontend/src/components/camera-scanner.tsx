@@ -4,6 +4,7 @@ import { useState, useRef, useEffect } from 'react';
 import { Button } from '@/components/ui/button';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from '@/components/ui/dialog';
 import { Camera, Scan, X, CheckCircle, AlertCircle } from 'lucide-react';
+import { barcodeApi } from '@/lib/api';
 
 interface CameraScannerProps {
   isOpen: boolean;
@@ -11,9 +12,25 @@ interface CameraScannerProps {
   onBarcodeScanned: (barcode: string) => void;
 }
 
+// Pause between frames sent for decoding, so one till doesn't flood the server's decoder pool
+const SCAN_INTERVAL_MS = 250;
+// Back-off when the server reports its decoders busy (429)
+const BUSY_RETRY_MS = 1000;
+// After this many single frames in a row without a barcode, send a burst of
+// frames in one request; the server tries its full strategy ladder on each
+const MISSES_BEFORE_BURST = 6;
+const BURST_FRAMES = 3;
+const BURST_SPACING_MS = 80;
+const FRAME_QUALITY = 0.8;
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
 export function CameraScanner({ isOpen, onClose, onBarcodeScanned }: CameraScannerProps) {
   const videoRef = useRef<HTMLVideoElement>(null);
   const canvasRef = useRef<HTMLCanvasElement>(null);
+  // Bumped on every start and stop, so a scan loop (and a frame in flight) from
+  // an earlier start knows to give up
+  const scanToken = useRef(0);
   const [isScanning, setIsScanning] = useState(false);
   const [scanResult, setScanResult] = useState<{ success: boolean; message: string; barcode?: string } | null>(null);
 
@@ -23,13 +40,19 @@ export function CameraScanner({ isOpen, onClose, onBarcodeScanned }: CameraScann
     } else {
       stopCamera();
     }
+    return stopCamera;
   }, [isOpen]);
 
   const startCamera = async () => {
+    const token = ++scanToken.current;
     try {
       const stream = await navigator.mediaDevices.getUserMedia({ 
         video: { facingMode: 'environment' } 
       });
+      if (token !== scanToken.current) {
+        stream.getTracks().forEach(track => track.stop());
+        return;
+      }
       
       if (videoRef.current) {
         videoRef.current.srcObject = stream;
@@ -39,7 +62,7 @@ export function CameraScanner({ isOpen, onClose, onBarcodeScanned }: CameraScann
       setScanResult(null);
       
       // Start scanning loop
-      requestAnimationFrame(scanBarcode);
+      scanLoop(token);
     } catch (error) {
       console.error('Error accessing camera:', error);
       setScanResult({
@@ -50,72 +73,99 @@ export function CameraScanner({ isOpen, onClose, onBarcodeScanned }: CameraScann
   };
 
   const stopCamera = () => {
+    scanToken.current += 1;
     if (videoRef.current?.srcObject) {
       const stream = videoRef.current.srcObject as MediaStream;
       stream.getTracks().forEach(track => track.stop());
+      videoRef.current.srcObject = null;
     }
     setIsScanning(false);
   };
 
-  const scanBarcode = async () => {
-    if (!videoRef.current || !canvasRef.current || !isScanning) return;
-
+  // The current video frame as a JPEG, or null until the camera has one
+  const captureFrame = (): Promise<Blob | null> => {
     const video = videoRef.current;
     const canvas = canvasRef.current;
-    const context = canvas.getContext('2d');
+    if (!video || !canvas || video.readyState < video.HAVE_ENOUGH_DATA) return Promise.resolve(null);
+
+    canvas.width = video.videoWidth;
+    canvas.height = video.videoHeight;
+    canvas.getContext('2d')?.drawImage(video, 0, 0, canvas.width, canvas.height);
+    return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', FRAME_QUALITY));
+  };
+
+  // Each returns the barcode found, or null if no frame was ready; the API
+  // rejects with status 404 when the frames hold no barcode
+  const scanSingleFrame = async (): Promise<string | null> => {
+    const frame = await captureFrame();
+    if (!frame) return null;
+    const result = await barcodeApi.scanFromBlob(frame);
+    return result.barcode;
+  };
 
-    if (video.readyState === video.HAVE_ENOUGH_DATA) {
-      canvas.width = video.videoWidth;
-      canvas.height = video.videoHeight;
-      context?.drawImage(video, 0, 0, canvas.width, canvas.height);
+  const scanBurst = async (): Promise<string | null> => {
+    const frames: Blob[] = [];
+    for (let i = 0; i < BURST_FRAMES; i++) {
+      const frame = await captureFrame();
+      if (frame) frames.push(frame);
+      await sleep(BURST_SPACING_MS);
+    }
+    if (!frames.length) return null;
+    const result = await barcodeApi.scanFrames(frames);
+    return result.barcodes[0].barcode;
+  };
 
+  const scanLoop = async (token: number) => {
+    let misses = 0;
+    while (token === scanToken.current) {
+      let delay = SCAN_INTERVAL_MS;
+      const burst = misses >= MISSES_BEFORE_BURST;
       try {
-        // This is where we would integrate with a barcode scanning library
-        // For now, we'll simulate scanning with a mock function
-        const mockBarcode = simulateBarcodeScan();
-        
-        if (mockBarcode) {
+        const barcode = burst ? await scanBurst() : await scanSingleFrame();
+        if (token !== scanToken.current) return;
+        if (burst) misses = 0;
+
+        if (barcode) {
+          scanToken.current += 1;
           setScanResult({
             success: true,
             message: 'Barcode scanned successfully!',
-            barcode: mockBarcode
+            barcode
           });
           setIsScanning(false);
           
           // Auto-close after successful scan
           setTimeout(() => {
-            onBarcodeScanned(mockBarcode);
+            onBarcodeScanned(barcode);
             onClose();
           }, 1500);
+          return;
         }
       } catch (error) {
-        console.error('Error scanning barcode:', error);
+        if (token !== scanToken.current) return;
+        const status = (error as { status?: number }).status;
+        if (status === 404) {
+          misses = burst ? 0 : misses + 1;
+        } else if (status === 429) {
+          delay = BUSY_RETRY_MS;
+        } else {
+          console.error('Error scanning barcode:', error);
+          scanToken.current += 1;
+          setIsScanning(false);
+          setScanResult({
+            success: false,
+            message: error instanceof Error ? error.message : 'Barcode scanning failed'
+          });
+          return;
+        }
       }
+      await sleep(delay);
     }
-
-    if (isScanning) {
-      requestAnimationFrame(scanBarcode);
-    }
-  };
-
-  const simulateBarcodeScan = (): string | null => {
-    // Simulate barcode detection with 30% success rate
-    if (Math.random() < 0.3) {
-      const sampleBarcodes = [
-        '8901234567890', // Milk
-        '8901234567891', // Bread
-        '8901234567892', // Eggs
-        '8901234567893', // Butter
-        '8901234567894'  // Cheese
-      ];
-      return sampleBarcodes[Math.floor(Math.random() * sampleBarcodes.length)];
-    }
-    return null;
   };
 
   const handleRetry = () => {
+    stopCamera();
     setScanResult(null);
-    setIsScanning(true);
     startCamera();
   };
 
@@ -1,7 +1,16 @@
+import type { ReceiptI } from './types';
+
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:5000/api';
+// Identifies this till's store to a multi-store backend (ignored by single-store ones)
+const STORE_ID = process.env.NEXT_PUBLIC_STORE_ID;
 
 // Generic API request function
 async function apiRequest(endpoint: string, options: RequestInit = {}) {
+  return (await apiRequestWithHeaders(endpoint, options)).data;
+}
+
+// Like apiRequest, but also returns the response headers (paging cursors, catalog version)
+async function apiRequestWithHeaders(endpoint: string, options: RequestInit = {}) {
   const url = `${API_BASE_URL}${endpoint}`;
   
   const defaultOptions: RequestInit = {
@@ -11,15 +20,22 @@ async function apiRequest(endpoint: string, options: RequestInit = {}) {
     },
   };
 
+  const requestOptions: RequestInit = { ...defaultOptions, ...options };
+  if (STORE_ID) {
+    requestOptions.headers = { ...(requestOptions.headers as Record<string, string>), 'X-Store-Id': STORE_ID };
+  }
+
   try {
-    const response = await fetch(url, { ...defaultOptions, ...options });
+    const response = await fetch(url, requestOptions);
     
     if (!response.ok) {
       const errorData = await response.json().catch(() => ({}));
-      throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+      throw Object.assign(new Error(errorData.error || `HTTP error! status: ${response.status}`), {
+        status: response.status,
+      });
     }
 
-    return await response.json();
+    return { data: await response.json(), headers: response.headers };
   } catch (error) {
     console.error(`API request failed for ${endpoint}:`, error);
     throw error;
@@ -29,12 +45,32 @@ async function apiRequest(endpoint: string, options: RequestInit = {}) {
 // Products API
 export const productsApi = {
   getAll: () => apiRequest('/products'),
+  // The full catalog plus its version (X-Catalog-Version), for getChanges and eventsApi.subscribe
+  getAllWithVersion: async (): Promise<{ products: Product[]; version: number | null }> => {
+    const { data, headers } = await apiRequestWithHeaders('/products');
+    const version = headers.get('X-Catalog-Version');
+    return { products: data, version: version === null ? null : Number(version) };
+  },
+  // Only what changed after a catalog version (the X-Catalog-Version of an earlier fetch).
+  // Fails with status 410 if that version is too old; reload the full catalog then.
+  getChanges: (since: number): Promise<{
+    version: number;
+    changed: Array<{ barcode: string; name: string; price: number; stock: number }>;
+    deleted: string[];
+  }> => apiRequest(`/products?since=${since}`),
   getByBarcode: (barcode: string) => apiRequest(`/products/${barcode}`),
+  // Name (prefix and typo tolerant) or barcode-prefix lookup for when a barcode won't scan
+  search: (query: string, limit = 20): Promise<Array<Product & { match: 'barcode' | 'prefix' | 'fuzzy' }>> =>
+    apiRequest(`/products/search?${new URLSearchParams({ q: query, limit: String(limit) })}`),
   create: (product: { barcode: string; name: string; price: number; stock: number }) =>
     apiRequest('/products', { method: 'POST', body: JSON.stringify(product) }),
   update: (barcode: string, updates: Partial<{ name: string; price: number; stock: number }>) =>
     apiRequest(`/products/${barcode}`, { method: 'PUT', body: JSON.stringify(updates) }),
   delete: (barcode: string) => apiRequest(`/products/${barcode}`, { method: 'DELETE' }),
+  bulkUpsert: (products: Array<{ barcode: string; name: string; price: number; stock: number }>) =>
+    apiRequest('/products/bulk', { method: 'POST', body: JSON.stringify(products) }),
+  adjustStock: (adjustments: Array<{ barcode: string; delta: number }>) =>
+    apiRequest('/stock/adjust', { method: 'POST', body: JSON.stringify(adjustments) }),
 };
 
 // Sales API
@@ -50,7 +86,15 @@ export const salesApi = {
 
 // Receipts API
 export const receiptsApi = {
+  // Newest receipts only; use getPage to page further back
   getAll: () => apiRequest('/receipts'),
+  // One page, newest first; pass the previous page's nextCursor for the next one
+  getPage: async (cursor?: string | null, limit = 50): Promise<{ receipts: ReceiptI[]; nextCursor: string | null }> => {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor) params.set('cursor', cursor);
+    const { data, headers } = await apiRequestWithHeaders(`/receipts?${params}`);
+    return { receipts: data, nextCursor: headers.get('X-Next-Cursor') };
+  },
   getById: (receiptId: string) => apiRequest(`/receipts/${receiptId}`),
   create: (receipt: {
     items: Array<{ name: string; quantity: number; price: number; subtotal: number }>;
@@ -64,6 +108,19 @@ export const receiptsApi = {
   delete: (receiptId: string) => apiRequest(`/receipts/${receiptId}`, { method: 'DELETE' }),
 };
 
+// Checkout API
+export const checkoutApi = {
+  create: (checkout: {
+    items: Array<{ barcode: string; quantity: number }>;
+    payment_method: string;
+    payment_status: string;
+    customer_name: string;
+    customer_phone: string;
+    amount_paid?: number;
+    allow_partial?: boolean;
+  }) => apiRequest('/checkout', { method: 'POST', body: JSON.stringify(checkout) }),
+};
+
 // Barcode API
 export const barcodeApi = {
   scanFromImage: (imageData: string) =>
@@ -71,9 +128,66 @@ export const barcodeApi = {
       method: 'POST', 
       body: JSON.stringify({ image: imageData }) 
     }),
+  // Sends the encoded frame as-is (no base64); scale/roi reduce server-side work
+  scanFromBlob: (image: Blob, options: { scale?: 1 | 2 | 4 | 8; roi?: string } = {}) => {
+    const params = new URLSearchParams();
+    if (options.scale) params.set('scale', String(options.scale));
+    if (options.roi) params.set('roi', options.roi);
+    const query = params.toString() ? `?${params}` : '';
+    return apiRequest(`/barcode/scan${query}`, {
+      method: 'POST',
+      headers: { 'Content-Type': image.type || 'application/octet-stream' },
+      body: image,
+    });
+  },
+  // Several frames of the same item in one request; returns every distinct barcode found
+  scanFrames: (images: Blob[], options: { roi?: string } = {}) => {
+    const form = new FormData();
+    images.forEach((image, index) => form.append('images', image, `frame-${index}`));
+    if (options.roi) form.append('roi', options.roi);
+    // Let the browser set the multipart boundary
+    return apiRequest('/barcode/scan/batch', { method: 'POST', headers: {}, body: form });
+  },
   validateBarcode: (barcode: string) => apiRequest(`/barcode/validate/${barcode}`),
 };
 
+// Catalog change events (server-sent events)
+export interface CatalogEvent {
+  seq: number;
+  type: 'product.created' | 'product.updated' | 'product.deleted' | 'stock.changed' | 'catalog.reset';
+  barcode: string | null;
+  product: { barcode: string; name: string; price: number; stock: number } | null;
+  created_at: string | null;
+}
+
+export const eventsApi = {
+  // EventSource resumes from the last event id by itself after a dropped connection,
+  // but gives up for good on an error response (e.g. 503 when the server has no free
+  // stream slots); onClosed is called then. Returns a function that closes the stream.
+  subscribe: (
+    onEvent: (event: CatalogEvent) => void,
+    after?: number,
+    handlers: { onOpen?: () => void; onClosed?: () => void } = {},
+  ) => {
+    const params = new URLSearchParams();
+    if (after !== undefined) params.set('after', String(after));
+    if (STORE_ID) params.set('store', STORE_ID);
+    const query = params.toString() ? `?${params}` : '';
+    const source = new EventSource(`${API_BASE_URL}/events${query}`);
+    const types: CatalogEvent['type'][] = [
+      'product.created', 'product.updated', 'product.deleted', 'stock.changed', 'catalog.reset',
+    ];
+    types.forEach(type =>
+      source.addEventListener(type, message => onEvent(JSON.parse((message as MessageEvent).data)))
+    );
+    source.onopen = () => handlers.onOpen?.();
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) handlers.onClosed?.();
+    };
+    return () => source.close();
+  },
+};
+
 // Types
 export interface Product {
   id: number;
@@ -110,4 +224,16 @@ export interface ForecastResult {
   alert: boolean;
   message: string;
   recommendation: string;
+  history_days?: number;
+  lead_time_days?: number;
+  products?: Array<{
+    barcode: string;
+    name: string;
+    current_stock: number;
+    units_sold: number;
+    velocity: number;
+    days_to_stockout: number | null;
+    reorder_quantity: number;
+    alert: boolean;
+  }>;
 }
\ No newline at end of file